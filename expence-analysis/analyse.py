@@ -17,28 +17,53 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import io
+import os
 import matplotlib.pyplot as plt
 import numpy as np
-from datetime import timedelta, datetime, date
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum
-from calendar import monthrange
 from copy import deepcopy
+from matplotlib.figure import Figure
+from matplotlib.patches import Rectangle
+
+from transaction_table import SymbolTable, TransactionTable
 
 class Granularity(Enum):
     Week = 0
     Month = 1
     Year = 2
+    Quarter = 3
+
+def total_expense(table, skip_account_transfers = True):
+    return float(table.amount[table.expenses(skip_account_transfers)].sum())
+
+def show_or_save(fig, output):
+    """
+    Show figure interactively if output is None. Otherwise save it to output;
+    the format is taken from the extension (.png, .svg or .html).
+    """
+    if output is None:
+        plt.show()
+        return
+
+    if output.endswith('.html'):
+        svg = io.StringIO()
+        fig.savefig(svg, format='svg', bbox_inches='tight')
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write('<!DOCTYPE html>\n<html><body>\n')
+            f.write(svg.getvalue())
+            f.write('</body></html>\n')
+    else:
+        fig.savefig(output, bbox_inches='tight')
 
-def total_expense(transactions, skip_account_transfers = True):
-    total = 0.
-    for t in transactions:
-        if skip_account_transfers and t.category == 'Account':
-            continue
-        if t.is_expense:
-            total += t.amount
-    return total
+def new_figure(output):
+    # Figures saved to files don't need pyplot and the interactive backend
+    if output is None:
+        return plt.figure()
+    return Figure()
 
-def pie_chart(groups, total = 1.):
+def pie_chart(groups, total = 1., output = None):
     payments = []
     labels = []
     g_sorted = sorted(((v,k) for k,v in groups.items()), reverse=True)
@@ -47,162 +72,315 @@ def pie_chart(groups, total = 1.):
         labels.append('{} - {:,.2f} ({:.1f}%)'.format(i[1], i[0], 100. * i[0] / total))
 
     # Draw a pie chart
-    pie = plt.pie(payments, startangle=90)
-    plt.axis('equal')
-    plt.tight_layout()
+    fig = new_figure(output)
+    ax = fig.subplots()
+    pie = ax.pie(payments, startangle=90)
+    ax.axis('equal')
+    fig.tight_layout()
 
     # Create a blank rectangle to add total label
-    extra = plt.Rectangle((0, 0), 1, 1, fc="w", fill=False, edgecolor='none', linewidth=0)
+    extra = Rectangle((0, 0), 1, 1, fc="w", fill=False, edgecolor='none', linewidth=0)
     pie[0].append(extra)
     labels.append("Total - {:,.2f}".format(total))
 
     # Add a legend
-    legend = plt.legend(pie[0], labels, loc='upper left', fontsize=10)
+    legend = ax.legend(pie[0], labels, loc='upper left', fontsize=10)
 
-    plt.show()
+    show_or_save(fig, output)
 
-def histogram(data, categories, labels, period_name):
+def histogram(data, categories, labels, period_name, output = None):
+    """ data[i][j] - amount for categories[i] during period labels[j] """
+    data = np.asarray(data, dtype=np.float64).reshape(len(categories), len(labels))
     index = np.arange(len(labels))
-    b = [0] * len(labels)
-    i = 0
-    for d in data:
-        plt.bar(index, d, bottom=b)
-        b = [b[i] + d[i] for i in range(len(b))]
-        i+=1
-    plt.xticks(index, labels, rotation=45, horizontalalignment='right')
-    plt.grid(axis='y', linestyle='--')
-    plt.legend(categories, loc='center left', bbox_to_anchor=(1, 0.5))
-    plt.show()
-
-def category_analysis(transactions, skip_account_transfers = True):
-    categories = {}
-    total = 0.
-    for t in transactions:
-        if skip_account_transfers and t.category == 'Account':
-            continue
-        if not t.is_expense:
-            continue
-        try:
-            categories[t.category] += t.amount
-        except KeyError:
-            categories[t.category] = t.amount
-        total += t.amount
-
-    pie_chart(categories, total)
+    # bottoms[i] - top of the stack below category i
+    bottoms = np.zeros_like(data)
+    np.cumsum(data[:-1], axis=0, out=bottoms[1:])
+
+    fig = new_figure(output)
+    ax = fig.subplots()
+    for d, b in zip(data, bottoms):
+        ax.bar(index, d, bottom=b)
+    ax.set_xticks(index, labels, rotation=45, horizontalalignment='right')
+    ax.grid(axis='y', linestyle='--')
+    ax.legend(categories, loc='center left', bbox_to_anchor=(1, 0.5))
+    show_or_save(fig, output)
+
+def rolling_chart(dates, data, categories, days, output = None):
+    """ data[i][j] - amount for categories[i] during days ending at dates[j] """
+    fig = new_figure(output)
+    ax = fig.subplots()
+    if len(dates):
+        ax.stackplot(dates, data, labels=categories)
+    ax.set_title("Expenses during last %d days" % days)
+    ax.grid(axis='y', linestyle='--')
+    ax.legend(loc='center left', bbox_to_anchor=(1, 0.5))
+    fig.autofmt_xdate()
+    show_or_save(fig, output)
+
+class Aggregation():
+    """
+    Expenses aggregated once and shared by all reports. Categories with less
+    than threshold of total expense are folded into 'Other' in a read-only
+    copy of category codes; the original table is not modified.
+    """
+    def __init__(self, table, skip_account_transfers = True, threshold = 0.01):
+        self.mask = table.expenses(skip_account_transfers)
+        totals = table.category_totals(self.mask)
+        self.total = float(totals.sum())
+
+        n_categories = len(table.categories)
+        present = np.bincount(table.category[self.mask],
+                              minlength=n_categories) > 0
+        small = present & (totals < self.total * threshold)
+
+        categories = SymbolTable()
+        for name in table.categories.names:
+            categories.code(name)
+        remap = np.arange(n_categories, dtype=np.int32)
+        if small.any():
+            remap[small] = categories.code('Other')
+
+        # totals[code] - amount for category with given code after folding
+        self.totals = np.bincount(remap, weights=totals,
+                                  minlength=len(categories))
+        self.present = np.unique(remap[present])
+        self.table = TransactionTable(readonly(table.date),
+                                      readonly(table.amount),
+                                      readonly(table.is_expense),
+                                      readonly(remap[table.category]),
+                                      readonly(table.recipient),
+                                      categories, table.recipients)
+        self.mask.flags.writeable = False
+
+    def groups(self):
+        """ Returns {category: amount} """
+        return {self.table.categories.names[c]: float(self.totals[c])
+                for c in self.present}
+
+def readonly(array):
+    view = array.view()
+    view.flags.writeable = False
+    return view
+
+def category_analysis(aggregation, output = None):
+    pie_chart(aggregation.groups(), aggregation.total, output)
 
 class AnalysisResult():
-    def __init__(self):
-        # amount[category] = [amount0, amount1, ...]
-        # amount[category][i] - amount spent for category during period i
+    def __init__(self, periods, categories, amount):
+        # amount[i, j] - amount spent for categories[j] during period i
         # periods[i] - name of period i
-        self.amount = {}
-        self.total = []
-        self.periods = []
-
-    def new_category(self, category):
-        if len(self.periods) <= 1:
-            self.amount[category] = []
-            self.amount[category].append(0)
-        else:
-            self.amount[category] = []
-            for i in range(len(self.periods)):
-                self.amount[category].append(0)
-
-    def add_expense(self, category, amount):
-        try:
-            self.total[-1] += amount
-        except:
-            self.total.append(0)
-
-        try:
-            self.amount[category][-1] += amount
-        except KeyError:
-            self.new_category(category)
-            self.amount[category][-1] += amount
-
-    def add_period(self, description):
-        self.periods.append(description)
-        for c in self.amount.values():
-            c.append(0)
+        self.periods = periods
+        self.categories = categories
+        self.amount = amount
+        self.total = amount.sum(axis=1)
+
+    @classmethod
+    def from_table(cls, table, mask, granularity):
+        """ Bin expenses selected by mask into periods in a single pass """
+        dates = table.date[mask]
+        codes = table.category[mask]
+
+        # period[i] - index of period transaction i belongs to
+        last_dates, period = np.unique(get_period_ends(dates, granularity),
+                                       return_inverse=True)
+        first_dates = np.full(len(last_dates), np.iinfo(np.int64).max)
+        np.minimum.at(first_dates, period, dates.astype(np.int64))
+        first_dates = first_dates.astype('datetime64[D]')
+
+        # Columns are categories in order of their first appearance
+        present, first_seen = np.unique(codes, return_index=True)
+        present = present[np.argsort(first_seen)]
+        column = np.zeros(len(table.categories), dtype=np.intp)
+        column[present] = np.arange(len(present))
+
+        n_periods = len(last_dates)
+        n_columns = len(present)
+        amount = np.bincount(period * n_columns + column[codes],
+                             weights=table.amount[mask],
+                             minlength=n_periods * n_columns)
+        amount = amount.reshape(n_periods, n_columns)
+
+        periods = [get_period_label(f.item(), l.item(), granularity)
+                   for f, l in zip(first_dates, last_dates)]
+        return cls(periods, [table.categories.names[c] for c in present],
+                   amount)
 
     def optimize_categories(self):
-        for category in list(self.amount.keys()):
-            active_periods = 0.
-            total_periods = 0.
-            for period in self.amount[category]:
-                total_periods += 1
-                if period != 0:
-                    active_periods += 1
-
-            if total_periods / active_periods > 4:
-                for i in range(int(total_periods)):
-                    try:
-                        self.amount['Other'][i] += self.amount[category][i]
-                    except KeyError:
-                        self.new_category('Other')
-                        self.amount['Other'][i] += self.amount[category][i]
-                del self.amount[category]
-
-def get_last_date(the_date, granularity):
-    if granularity == Granularity.Week:
-        # Closest Sunday
-        return the_date + timedelta((13 - the_date.weekday()) % 7)
-    if granularity == Granularity.Month:
-        return date(the_date.year, the_date.month,
-                    monthrange(the_date.year, the_date.month)[1])
+        """
+        Categories active in less than a quarter of periods are folded into
+        'Other'.
+        """
+        active_periods = np.count_nonzero(self.amount, axis=0)
+        sparse = active_periods * 4 < len(self.periods)
+        if 'Other' in self.categories:
+            other = self.categories.index('Other')
+            sparse[other] = False
+        if not sparse.any():
+            return
+
+        folded = self.amount[:, sparse].sum(axis=1)
+        keep = ~sparse
+        self.categories = [c for c, k in zip(self.categories, keep) if k]
+        self.amount = self.amount[:, keep]
+        if 'Other' in self.categories:
+            self.amount[:, self.categories.index('Other')] += folded
+        else:
+            self.categories.append('Other')
+            self.amount = np.column_stack((self.amount, folded))
 
 def get_name(granularity):
     if granularity == Granularity.Week:
         return "week"
     if granularity == Granularity.Month:
         return "month"
+    if granularity == Granularity.Quarter:
+        return "quarter"
+    if granularity == Granularity.Year:
+        return "year"
+
+def get_period_label(first_date, last_date, granularity):
+    if granularity == Granularity.Quarter:
+        return "{0:%Y} Q{1}".format(last_date, last_date.month // 3)
+    if granularity == Granularity.Year:
+        return "{0:%Y}".format(last_date)
+    return "{0:%b %d} - {1:%b %d}".format(first_date, last_date)
+
+def get_period_ends(dates, granularity):
+    """ Last dates of periods containing dates, datetime64[D] array """
+    if granularity == Granularity.Week:
+        # 1970-01-01 is Thursday
+        weekday = (dates.astype(np.int64) + 3) % 7
+        return dates + ((6 - weekday) % 7).astype('timedelta64[D]')
+
+    if granularity == Granularity.Month:
+        months = dates.astype('datetime64[M]')
+    elif granularity == Granularity.Quarter:
+        months = dates.astype('datetime64[M]')
+        months = months - (months.astype(np.int64) % 3).astype('timedelta64[M]')
+        months = months + np.timedelta64(2, 'M')
+    elif granularity == Granularity.Year:
+        months = (dates.astype('datetime64[Y]').astype('datetime64[M]') +
+                  np.timedelta64(11, 'M'))
+    return (months + 1).astype('datetime64[D]') - np.timedelta64(1, 'D')
+
+class PrefixSums():
+    """
+    Cumulative daily expenses per category. After one O(n) pass the amount
+    spent during any range of days is a difference of two rows, so every
+    rolling window is O(1).
+    """
+    def __init__(self, table, skip_account_transfers = True):
+        mask = table.expenses(skip_account_transfers)
+        dates = table.date[mask]
+        self.categories = table.categories.names
+        n_categories = len(self.categories)
+        if len(dates) == 0:
+            self.first_date = np.datetime64('1970-01-01')
+            self.cumulative = np.zeros((1, n_categories))
+            return
+
+        self.first_date = dates.min()
+        day = (dates - self.first_date).astype(np.int64)
+        n_days = int(day.max()) + 1
+        daily = np.bincount(day * n_categories + table.category[mask],
+                            weights=table.amount[mask],
+                            minlength=n_days * n_categories)
+        # cumulative[i] - amount spent before day i
+        self.cumulative = np.zeros((n_days + 1, n_categories))
+        np.cumsum(daily.reshape(n_days, n_categories), axis=0,
+                  out=self.cumulative[1:])
 
-def comparative_analysis(transactions, skip_account_transfers = True,
-                         granularity = Granularity.Month):
-    last_date = datetime.min.date()
-    result = AnalysisResult()
-    for t in transactions:
-        if skip_account_transfers and t.category == 'Account':
-            continue
-        if not t.is_expense:
-            continue
-
-        if t.date <= last_date:
-            # Current period. Update the result
-            result.add_expense(t.category, t.amount)
+    def rolling(self, days, category = None):
+        """
+        Returns (last_dates, amounts): amount spent during days-long window
+        ending at every day.
+        """
+        values = self.cumulative
+        if category is None:
+            values = values.sum(axis=1)
+        elif category in self.categories:
+            values = values[:, self.categories.index(category)]
         else:
-            # Next period
-            first_date = t.date
-            last_date = get_last_date(t.date, granularity)
-            result.add_period("{0:%b %d} - {1:%b %d}".format(first_date,
-                                                             last_date))
-            result.add_expense(t.category, t.amount)
+            values = np.zeros(len(values))
+        start = np.maximum(np.arange(1, len(values)) - days, 0)
+        amounts = values[1:] - values[start]
+        last_dates = self.first_date + np.arange(len(amounts)).astype('timedelta64[D]')
+        return last_dates, amounts
+
+def comparative_result(aggregation, granularity = Granularity.Month):
+    result = AnalysisResult.from_table(aggregation.table, aggregation.mask,
+                                       granularity)
     result.optimize_categories()
-    histogram(result.amount.values(), result.amount.keys(), result.periods,
-              get_name(granularity))
+    return result
+
+def comparative_analysis(aggregation, granularity = Granularity.Month,
+                         output = None):
+    result = comparative_result(aggregation, granularity)
+    histogram(result.amount.T, result.categories, result.periods,
+              get_name(granularity), output)
+
+def rolling_result(aggregation, days):
+    """
+    Returns (last_dates, categories, amount) where amount[i, j] is amount
+    spent for categories[i] during days-long window ending at last_dates[j].
+    Categories are ordered by total expense.
+    """
+    sums = PrefixSums(aggregation.table)
+    present = sorted(aggregation.present, key=lambda c: -aggregation.totals[c])
+    categories = [aggregation.table.categories.names[c] for c in present]
+    last_dates, _ = sums.rolling(days)
+    amount = np.array([sums.rolling(days, c)[1] for c in categories])
+    return last_dates, categories, amount.reshape(len(categories),
+                                                  len(last_dates))
+
+def rolling_analysis(aggregation, days, output = None):
+    last_dates, categories, amount = rolling_result(aggregation, days)
+    rolling_chart(last_dates, amount, categories, days, output)
+
+report_granularities = [Granularity.Week, Granularity.Month,
+                        Granularity.Quarter, Granularity.Year]
+
+def render_task(task):
+    kind, args, output = task
+    if kind == 'pie':
+        pie_chart(*args, output=output)
+    elif kind == 'rolling':
+        rolling_chart(*args, output=output)
+    else:
+        histogram(*args, output=output)
+    return output
+
+def render_reports(aggregation, directory, formats = ('png',), jobs = None,
+                   window = None):
+    """
+    Render pie chart, histograms for all granularities and, if window is
+    given, expenses during rolling window-days periods to files without
+    showing them. Charts are drawn in worker processes. Returns list of
+    written files.
+    """
+    os.makedirs(directory, exist_ok=True)
+    charts = [('pie', (aggregation.groups(), aggregation.total), 'categories')]
+    for granularity in report_granularities:
+        result = comparative_result(aggregation, granularity)
+        charts.append(('histogram', (result.amount.T, result.categories,
+                                     result.periods, get_name(granularity)),
+                       get_name(granularity)))
+    if window:
+        last_dates, categories, amount = rolling_result(aggregation, window)
+        charts.append(('rolling', (last_dates, amount, categories, window),
+                       'rolling-%d' % window))
+
+    tasks = [(kind, args, os.path.join(directory, name + '.' + fmt))
+             for kind, args, name in charts for fmt in formats]
+    if jobs == 1:
+        return [render_task(t) for t in tasks]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(render_task, tasks))
 
-def optimize(transactions, skip_account_transfers = True):
+def optimize(table, skip_account_transfers = True):
     """
-    If expense per category is less than 1% than category name is changes to
-    'Other' for all transactions that maches this category.
+    If expense per category is less than 1% than category name is changed to
+    'Other' for all transactions that match this category. Returns
+    Aggregation, transactions in the table are not modified.
     """
-    categories = {}
-    total = 0.
-    for t in transactions:
-        if skip_account_transfers and t.category == 'Account':
-            continue
-        if not t.is_expense:
-            continue
-        try:
-            categories[t.category] += t.amount
-        except KeyError:
-            categories[t.category] = t.amount
-        total += t.amount
-
-    for t in transactions:
-        if skip_account_transfers and t.category == 'Account':
-            continue
-        if not t.is_expense:
-            continue
-        if categories[t.category] < (total * 0.01):
-            t.category = 'Other'
+    return Aggregation(table, skip_account_transfers)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+    bench_matcher.py - compare compiled recipient matcher with linear scan
+    over category patterns.
+
+    Copyright (C) 2017 Evgenii Iuliugin
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import random
+import string
+import sys
+import time
+
+import transaction
+
+def linear_match(patterns, recipient):
+    for p in patterns:
+        if p['reobj'].match(recipient):
+            return p['name']
+    return None
+
+def synthetic_recipients(patterns, count, seed):
+    """
+    Half of recipients match some wildcard rule, the rest are random names
+    that go through all the rules without match.
+    """
+    rnd = random.Random(seed)
+    alphabet = string.ascii_uppercase + ' '
+    ret = []
+    for i in range(count):
+        noise = ''.join(rnd.choice(alphabet) for _ in range(8))
+        if i % 2 == 0 and patterns:
+            ret.append(rnd.choice(patterns)['name'] + noise)
+        else:
+            ret.append(noise)
+    return ret
+
+def mkenv():
+    parser = argparse.ArgumentParser(add_help=True,
+                                     description="Recipient matcher benchmark.")
+    parser.add_argument("-c", "--categories", type=str, default="categories.txt",
+                        help="Path to categories file.")
+    parser.add_argument("-n", "--count", type=int, default=100000,
+                        help="Number of synthetic recipients.")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+def main():
+    env = mkenv()
+    transaction.read_categories(env.categories)
+    patterns = transaction.patterns
+    recipients = synthetic_recipients(patterns, env.count, env.seed)
+
+    start = time.perf_counter()
+    matcher = transaction.PatternMatcher(patterns)
+    compile_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    expected = [linear_match(patterns, r) for r in recipients]
+    linear_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = [matcher.match(r) for r in recipients]
+    compiled_time = time.perf_counter() - start
+
+    if expected != actual:
+        print("Results differ!")
+        return 1
+
+    print("%d rules, %d recipients" % (len(patterns), len(recipients)))
+    print("linear scan: %.3fs (%.0f recipients/s)"
+          % (linear_time, len(recipients) / linear_time))
+    print("compiled:    %.3fs (%.0f recipients/s), compile %.3fs"
+          % (compiled_time, len(recipients) / compiled_time, compile_time))
+    print("speedup:     %.1fx" % (linear_time / compiled_time))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+    benchmark.py - measure every stage of the expense pipeline on synthetic
+    exports.
+
+    Copyright (C) 2017 Evgenii Iuliugin
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import csv
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+import openpyxl
+
+import analyse
+import ingest
+import profiling
+import transaction
+from date_parser import parse_date
+from transaction_table import TransactionTable
+
+category_names = ['Public catering', 'Supermarkets', 'Electronics',
+                  'Household', 'Flowers', 'Clothes and Shoes', 'Transport',
+                  'Health', 'Sport', 'Travel', 'Entertainment', 'Books']
+
+def write_categories(filename, exact, wildcards):
+    """
+    Write categories file with given number of exact names (SHOP00001) and
+    wildcard rules (CHAIN0001*). Returns (exact names, wildcard prefixes).
+    """
+    names = ['SHOP%05d' % i for i in range(exact)]
+    prefixes = ['CHAIN%04d' % i for i in range(wildcards)]
+    with open(filename, 'w', encoding='utf-8') as f:
+        for i, category in enumerate(category_names):
+            f.write('[%s]\n' % category)
+            for name in names[i::len(category_names)]:
+                f.write(name + '\n')
+            for prefix in prefixes[i::len(category_names)]:
+                f.write(prefix + '*\n')
+    return names, prefixes
+
+def synthetic_rows(count, names, prefixes, seed):
+    """
+    Yields (date, receiver, amount, verification). 40% of receivers are exact
+    names, 40% match wildcard rules and the rest are unknown.
+    """
+    rnd = random.Random(seed)
+    first = date(2015, 1, 1)
+    for i in range(count):
+        d = first + timedelta(days=rnd.randrange(3650))
+        kind = rnd.random()
+        if kind < 0.4 and names:
+            receiver = rnd.choice(names)
+        elif kind < 0.8 and prefixes:
+            receiver = rnd.choice(prefixes) + ' STOCKHOLM'
+        else:
+            receiver = 'UNKNOWN%05d' % rnd.randrange(10000)
+        amount = -round(rnd.uniform(1, 2000), 2)
+        if rnd.random() < 0.05:
+            amount = -amount
+        yield d, receiver, amount, '%010d' % i
+
+def write_seb_xlsx(filename, rows):
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet('ExportSida1')
+    for i in range(5):
+        ws.append(['Header'])
+    balance = 0.
+    for d, receiver, amount, verification in rows:
+        balance += amount
+        ws.append([d.isoformat(), d.isoformat(), verification,
+                   '%s/%s' % (receiver, d.strftime('%y-%m-%d')), amount,
+                   round(balance, 2)])
+    wb.save(filename)
+
+def write_seb_csv(filename, rows):
+    with open(filename, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        for i in range(5):
+            writer.writerow(['Header'])
+        balance = 0.
+        for d, receiver, amount, verification in rows:
+            balance += amount
+            writer.writerow([d.isoformat(), d.isoformat(), verification,
+                             '%s/%s' % (receiver, d.strftime('%y-%m-%d')),
+                             '%.2f' % amount, '%.2f' % balance])
+
+def write_wirecard_xls(filename, rows):
+    # xlwt is needed only to generate Wirecard files
+    import xlwt
+    book = xlwt.Workbook()
+    sheet = book.add_sheet('Transactions')
+    sheet.write(0, 0, 'Header')
+    for rx, (d, receiver, amount, verification) in enumerate(rows, 1):
+        sheet.write(rx, 1, '%.2f' % amount)
+        sheet.write(rx, 10, d.strftime('%d/%m/%Y'))
+        sheet.write(rx, 18, receiver)
+    book.save(filename)
+
+writers = {
+    'seb_xlsx': (write_seb_xlsx, '.xlsx'),
+    'seb_csv': (write_seb_csv, '.csv'),
+    'wirecard_xls': (write_wirecard_xls, '.xls'),
+}
+
+class Stages():
+    """
+    Collects (name, seconds, rows, peak memory) for every stage. Peak memory
+    is the most memory allocated by the stage above what was allocated
+    before it, traced by tracemalloc if memory is True and None otherwise.
+    """
+    def __init__(self, memory = False):
+        self.memory = memory
+        self.results = []
+
+    def run(self, name, rows, function, *args):
+        with profiling.stage(name):
+            tracing = tracemalloc.is_tracing()
+            if self.memory and not tracing:
+                tracemalloc.start()
+            if self.memory:
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+            start = time.perf_counter()
+            ret = function(*args)
+            elapsed = time.perf_counter() - start
+            peak = None
+            if self.memory:
+                peak = tracemalloc.get_traced_memory()[1] - before
+                if not tracing:
+                    tracemalloc.stop()
+        self.results.append((name, elapsed, rows, peak))
+        return ret
+
+    def report(self):
+        print("%-30s %10s %14s %14s" % ("stage", "time, s", "rows/s",
+                                         "peak mem, MiB"))
+        for name, elapsed, rows, peak in self.results:
+            print("%-30s %10.3f %14.0f %14s"
+                  % (name, elapsed, rows / elapsed if elapsed else 0.,
+                     "%.1f" % (peak / 2**20) if peak is not None else "-"))
+
+def parse(fmt, filename):
+    # The reader alone, ingest.read_file categorises transactions as well
+    return list(ingest.readers[fmt](filename))
+
+def categorise(transactions):
+    # Categories are resolved on first access
+    for t in transactions:
+        t.category
+
+def benchmark(fmt, filename, rows, stages):
+    transaction.cache.clear()
+    transaction.unknown.clear()
+    transactions = stages.run(fmt + ': parse', rows, parse, fmt, filename)
+    stages.run(fmt + ': get_category', rows, categorise, transactions)
+    table = stages.run(fmt + ': table', rows,
+                       TransactionTable.from_transactions, transactions)
+    table.sort_by_date()
+    aggregation = stages.run(fmt + ': aggregate', rows, analyse.optimize, table)
+    for granularity in analyse.report_granularities:
+        stages.run('%s: %s periods' % (fmt, analyse.get_name(granularity)),
+                   rows, analyse.comparative_result, aggregation, granularity)
+    stages.run(fmt + ': rolling 30 days', rows, analyse.rolling_result,
+               aggregation, 30)
+
+class DictTransaction:
+    """ Transaction with per-instance dict and own strings for comparison """
+    def __init__(self, date, recipient, amount, verification = None):
+        self.date = date
+        self.verification = verification
+        self.amount = abs(amount)
+        self.is_expense = amount < 0
+        self.recipient = recipient
+        self.category = transaction.get_category(recipient) \
+                        if self.is_expense else "Refill"
+
+def transaction_memory(cls, rows):
+    """ Returns bytes allocated per transaction of given class """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    transactions = []
+    for d, receiver, amount, verification in rows:
+        # Readers produce a new string object for every row and share dates
+        # through the date parser cache
+        receiver = (receiver + '/')[:-1]
+        d = parse_date(d.isoformat(), "%Y-%m-%d")
+        t = cls(d, receiver, amount, verification)
+        t.category
+        transactions.append(t)
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return size / len(transactions)
+
+def memory_benchmark(count, names, prefixes, seed):
+    print("Memory per transaction (%d transactions):" % count)
+    for cls in (DictTransaction, transaction.Transaction):
+        rows = synthetic_rows(count, names, prefixes, seed)
+        print("  %-16s %8.1f bytes" % (cls.__name__,
+                                       transaction_memory(cls, rows)))
+
+def mkenv():
+    parser = argparse.ArgumentParser(add_help=True,
+                                     description="Expense pipeline benchmark.")
+    parser.add_argument("-n", "--rows", type=int, default=10000,
+                        help="Number of rows in every synthetic export.")
+    parser.add_argument("--exact", type=int, default=500,
+                        help="Number of exact recipient names in categories.")
+    parser.add_argument("--wildcards", type=int, default=100,
+                        help="Number of wildcard rules in categories.")
+    parser.add_argument("-f", "--formats", type=str,
+                        default="seb_xlsx,seb_csv,wirecard_xls",
+                        help="Comma separated list of formats to benchmark.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", type=str, default=None,
+                        help="Write synthetic files to this directory and " +
+                             "keep them.")
+    parser.add_argument("--memory", action="store_true",
+                        help="Trace peak memory of every stage and measure " +
+                             "memory used by Transaction objects. Tracing " +
+                             "makes stages several times slower.")
+    parser.add_argument("--profile", type=str, default=None,
+                        help="Dump cProfile and tracemalloc statistics " +
+                             "for every stage to this directory.")
+    return parser.parse_args()
+
+def main():
+    env = mkenv()
+    if env.profile:
+        profiling.enable(env.profile)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = env.keep if env.keep else tmp
+        os.makedirs(directory, exist_ok=True)
+        categories = os.path.join(directory, 'categories.txt')
+        names, prefixes = write_categories(categories, env.exact, env.wildcards)
+        transaction.load_categories(categories,
+                                    os.path.join(directory, 'categories'),
+                                    os.path.join(directory, '.categories.idx'))
+
+        stages = Stages(env.memory)
+        for fmt in env.formats.split(','):
+            write, extension = writers[fmt]
+            filename = os.path.join(directory, 'export' + extension)
+            rows = synthetic_rows(env.rows, names, prefixes, env.seed)
+            try:
+                stages.run(fmt + ': generate', env.rows, write, filename, rows)
+            except ImportError as e:
+                # Optional writer like xlwt is not installed
+                print("%s: skipped (%s)" % (fmt, e))
+                continue
+            benchmark(fmt, filename, env.rows, stages)
+
+    print("%d rows, %d exact names, %d wildcard rules"
+          % (env.rows, env.exact, env.wildcards))
+    stages.report()
+    if env.memory:
+        memory_benchmark(env.rows, names, prefixes, env.seed)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+"""
+    date_parser.py - fast date parsing shared by statement readers.
+
+    Copyright (C) 2017 Evgenii Iuliugin
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from datetime import date, datetime
+from functools import lru_cache
+
+import numpy as np
+
+def year2(yy):
+    # The same pivot as strptime uses for %y
+    return 2000 + yy if yy < 69 else 1900 + yy
+
+# format: (length, separator positions, function building date from string)
+fast_formats = {
+    "%Y-%m-%d": (10, ((4, '-'), (7, '-')),
+                 lambda s: date(int(s[0:4]), int(s[5:7]), int(s[8:10]))),
+    "%y-%m-%d": (8, ((2, '-'), (5, '-')),
+                 lambda s: date(year2(int(s[0:2])), int(s[3:5]), int(s[6:8]))),
+    "%d/%m/%Y": (10, ((2, '/'), (5, '/')),
+                 lambda s: date(int(s[6:10]), int(s[3:5]), int(s[0:2]))),
+}
+
+@lru_cache(maxsize=65536)
+def parse_date(date_str, fmt):
+    """
+    Equivalent of datetime.strptime(date_str, fmt).date(). Known fixed width
+    formats are parsed by slicing, anything else falls back to strptime.
+    Results are memoized since statements repeat the same dates many times.
+    Raises ValueError if date_str doesn't match fmt.
+    """
+    try:
+        length, separators, build = fast_formats[fmt]
+    except KeyError:
+        return datetime.strptime(date_str, fmt).date()
+
+    if (len(date_str) == length and
+            all(date_str[i] == c for i, c in separators) and
+            date_str.replace(separators[0][1], '').isdigit()):
+        return build(date_str)
+    return datetime.strptime(date_str, fmt).date()
+
+def to_datetime64(date_strs, fmt):
+    """ Convert a whole column of date strings to datetime64[D] array """
+    date_strs = np.asarray(date_strs, dtype=str)
+    if fmt == "%Y-%m-%d" and (np.char.str_len(date_strs) == 10).all():
+        try:
+            return date_strs.astype('datetime64[D]')
+        except ValueError:
+            pass
+    unique, inverse = np.unique(date_strs, return_inverse=True)
+    dates = np.array([parse_date(s, fmt) for s in unique],
+                     dtype='datetime64[D]')
+    return dates[inverse]
@@ -18,36 +18,70 @@
 """
 
 import csv
-from datetime import datetime
+import gzip
+import io
+import mmap
+import zipfile
 from itertools import islice
 
+from date_parser import parse_date
+from receiver import normalize_receiver
 from transaction import Transaction
 
-def expense_reader(filename):
+def is_zip(filename):
+    with open(filename, 'rb') as f:
+        return f.read(4) == b'PK\x03\x04'
+
+def is_gzip(filename):
+    with open(filename, 'rb') as f:
+        return f.read(2) == b'\x1f\x8b'
+
+def read_lines(filename, encoding = 'utf-8-sig'):
+    """
+    Yields decoded lines of the export. gzip and zip compressed files are
+    decompressed on the fly, plain files are memory-mapped.
+    """
+    if is_gzip(filename):
+        with gzip.open(filename, 'rt', encoding=encoding, newline='') as f:
+            yield from f
+    elif is_zip(filename):
+        with zipfile.ZipFile(filename) as zf:
+            # Archive is expected to contain a single export
+            name = next(n for n in zf.namelist() if not n.endswith('/'))
+            with zf.open(name) as raw:
+                yield from io.TextIOWrapper(raw, encoding=encoding, newline='')
+    else:
+        with open(filename, 'rb') as f:
+            if f.seek(0, io.SEEK_END) == 0:
+                # Empty files can't be mapped
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                line = mm.readline()
+                if line.startswith(b'\xef\xbb\xbf') and encoding == 'utf-8-sig':
+                    line = line[3:]
+                while line:
+                    yield line.decode(encoding)
+                    line = mm.readline()
+
+def expense_reader(filename, encoding = 'utf-8-sig'):
     """
     File format:
     Accounting date, currency date, verification number, receiver, amount, balance
+
+    Yields transactions one by one.
     """
-    ret = list()
-    with open(filename, 'rb') as csvfile:
-        expense_reader = csv.reader(csvfile)
-
-        # Skip lines that doesn't contatin relevant transaction information
-        for i in islice(expense_reader, 5, None):
-            # Remove trailing spaces
-            receiver = unicode(i[3].strip())
-            date = None
-
-            # Receiver are usually in "Name/YY-MM-DD" format.
-            # Separate these fields
-            namedate = receiver.split('/')
-            if len(namedate) == 2:
-                date = datetime.strptime(namedate[1], "%y-%m-%d").date()
-                receiver = namedate[0].strip()
-            else:
-                # Use currency date if date is not available in receiver field
-                date = datetime.strptime(i[1], "%Y-%m-%d").date()
-
-            ret.append(Transaction(date, receiver, i[4]))
-
-    return ret
+    expense_reader = csv.reader(read_lines(filename, encoding))
+
+    # Skip lines that doesn't contatin relevant transaction information
+    for i in islice(expense_reader, 5, None):
+        if len(i) < 5:
+            continue
+
+        # Receiver are usually in "Name/YY-MM-DD" format.
+        # Separate these fields
+        receiver, date = normalize_receiver(i[3])
+        if date == None:
+            # Use currency date if date is not available in receiver field
+            date = parse_date(i[1], "%Y-%m-%d")
+
+        yield Transaction(date, receiver, i[4], i[2])
@@ -19,53 +19,49 @@
 """
 
 import openpyxl
-from datetime import datetime
 from itertools import islice
-import re
 
+from date_parser import parse_date
+from receiver import normalize_receiver
 from transaction import Transaction
 
 def expense_reader(filename):
-    ret = list()
-    wb = openpyxl.load_workbook(filename = filename)
+    """
+    Yields transactions one by one. Workbook is opened in read-only mode so
+    rows are streamed from the file instead of being loaded at once.
+    """
+    wb = openpyxl.load_workbook(filename = filename, read_only = True)
 
     # Bokfringsdatum, Valutadatum, Verifikationsnummer, Text, Belopp, Saldo
     receiver_column = 3
     date_column  = 1
+    verification_column = 2
     amount_column = 4
     if wb.sheetnames[0] == 'ExportSida1':
         rows_to_skip = 5
     elif wb.sheetnames[0] == 'Sheet1':
         rows_to_skip = 8
     else:
+        wb.close()
         assert False, f'Unknown SEB format. First sheet: {wb.sheetnames[0]}'
 
     p = wb[wb.sheetnames[0]]
-    # Skip lines that doesn't contatin relevant transaction information
-    for row in islice(p.iter_rows(), rows_to_skip, None):
-        # Remove trailing spaces
-        receiver = row[receiver_column].value.strip()
-        date = None
+    try:
+        # Skip lines that doesn't contatin relevant transaction information
+        for row in islice(p.iter_rows(values_only = True), rows_to_skip, None):
+            if len(row) <= amount_column or row[receiver_column] is None:
+                # Read-only mode reports trailing empty rows
+                continue
 
-        # Receiver is usually in "Name/YY-MM-DD" format.
-        # Separate these fields
-        namedate = receiver.split('/')
-        if len(namedate) >= 2:
-            try:
-                date = datetime.strptime(namedate[-1], "%y-%m-%d").date()
-            except ValueError:
-                pass
-            else:
-                # '/' symbols can be in the middle of the string
-                receiver = receiver[:-(len(namedate[-1]) + 1)].strip()
+            # Receiver is usually in "Name/YY-MM-DD" format.
+            # Separate these fields
+            receiver, date = normalize_receiver(row[receiver_column])
 
-        if date == None:
-            # Use date_column if date is not available in receiver field
-            date = datetime.strptime(row[date_column].value, "%Y-%m-%d").date()
+            if date == None:
+                # Use date_column if date is not available in receiver field
+                date = parse_date(row[date_column], "%Y-%m-%d")
 
-        # Remove special symbols from the end of the name
-        receiver = re.sub(r'(([^\w]|_|\s)+)$', '', receiver)
-
-        ret.append(Transaction(date, receiver, row[amount_column].value))
-
-    return ret
+            yield Transaction(date, receiver, row[amount_column],
+                              row[verification_column])
+    finally:
+        wb.close()
@@ -18,12 +18,14 @@
 """
 
 import xlrd
-from datetime import datetime
 from itertools import islice
 
+from date_parser import parse_date
+from money import base_currency
 from transaction import Transaction
 
-def expense_reader(filename):
+def expense_reader(filename, currency = base_currency):
+    """ currency is the currency of the card, all amounts are in it """
     ret = []
 
     rows_to_skip = 1
@@ -38,7 +40,8 @@ def expense_reader(filename):
         amount = row[amount_column].value
         if amount  == '0.00':
             continue
-        date = datetime.strptime(row[date_column].value, "%d/%m/%Y").date()
-        ret.append(Transaction(date, row[receiver_column].value, amount))
+        date = parse_date(row[date_column].value, "%d/%m/%Y")
+        ret.append(Transaction(date, row[receiver_column].value, amount,
+                               currency=currency))
 
     return ret
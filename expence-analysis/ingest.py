@@ -0,0 +1,214 @@
+"""
+    ingest.py - read expense data from many files of different formats.
+
+    Copyright (C) 2017 Evgenii Iuliugin
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import glob
+import os
+import zipfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import compress
+
+import numpy as np
+
+import expense_from_seb_csv
+import expense_from_seb_xlsx
+import expense_from_wirecard_xls
+import transaction
+from money import base_currency
+from transaction_table import TransactionTable
+
+readers = {
+    'seb_xlsx': expense_from_seb_xlsx.expense_reader,
+    'seb_csv': expense_from_seb_csv.expense_reader,
+    'wirecard_xls': expense_from_wirecard_xls.expense_reader,
+}
+
+def detect_format(filename):
+    """ Guess the format of the export by its first bytes """
+    with open(filename, 'rb') as f:
+        magic = f.read(8)
+    if magic.startswith(b'PK\x03\x04'):
+        # xlsx is a zip archive as well. Sheet name is checked by the reader.
+        with zipfile.ZipFile(filename) as zf:
+            if 'xl/workbook.xml' in zf.namelist():
+                return 'seb_xlsx'
+        return 'seb_csv'
+    if magic.startswith(b'\xd0\xcf\x11\xe0'):
+        return 'wirecard_xls'
+    # Plain or gzip compressed csv
+    return 'seb_csv'
+
+def expand(paths):
+    """ Expand glob patterns. Paths that don't match anything are kept. """
+    ret = []
+    for path in paths:
+        matches = sorted(glob.glob(path, recursive=True))
+        ret.extend(matches if matches else [path])
+    return ret
+
+def iter_file(filename, card_currency = base_currency):
+    """
+    Transactions of the file as produced by its reader, lazily if the reader
+    yields them. card_currency is the currency of Wirecard exports.
+    """
+    fmt = detect_format(filename)
+    if fmt == 'wirecard_xls':
+        return readers[fmt](filename, card_currency)
+    return readers[fmt](filename)
+
+class FileColumns():
+    """
+    Transactions of one file column by column. Much smaller than a list of
+    Transaction objects when sent from a worker process: dates, cents and
+    is_expense are arrays, recipients, currencies, verifications and
+    categories are lists of interned strings that are pickled once each.
+    Categories are resolved while the columns are built.
+    """
+    def __init__(self, transactions):
+        date = []
+        cents = []
+        is_expense = []
+        self.recipient = []
+        self.currency = []
+        self.verification = []
+        self.category = []
+        for t in transactions:
+            date.append(t.date)
+            cents.append(t.cents)
+            is_expense.append(t.is_expense)
+            self.recipient.append(t.recipient)
+            self.currency.append(t.currency)
+            self.verification.append(t.verification)
+            self.category.append(t.category)
+        self.date = np.array(date, dtype='datetime64[D]')
+        self.cents = np.array(cents, dtype=np.int64)
+        self.is_expense = np.array(is_expense, dtype=bool)
+
+    def __len__(self):
+        return len(self.recipient)
+
+    def keys(self):
+        """ Transaction.key() of every row """
+        return zip(self.date.tolist(), self.recipient, self.cents.tolist(),
+                   self.currency, self.is_expense.tolist(), self.verification)
+
+def read_file(filename, card_currency = base_currency):
+    """
+    Returns (FileColumns, unknown recipients, cache counters) for the file.
+    Unknown recipients and counters are returned explicitly because the file
+    may be read in a worker process.
+    """
+    unknown = Counter(transaction.unknown)
+    before = transaction.cache.stats()
+    ret = FileColumns(iter_file(filename, card_currency))
+    after = transaction.cache.stats()
+    stats = {k: after[k] - before[k]
+             for k in ('hits', 'misses', 'evictions', 'size')}
+    return ret, transaction.unknown - unknown, stats
+
+def deduplicated(per_file):
+    """
+    Overlapping exports contain the same rows. The same transaction can
+    legitimately appear several times in one file, so a row is dropped only
+    when it was already seen as many times in another file. Yields
+    transactions of iterables in per_file that are kept.
+    """
+    seen = Counter()
+    for transactions in per_file:
+        counts = Counter()
+        for t in transactions:
+            k = t.key()
+            counts[k] += 1
+            if counts[k] > seen[k]:
+                yield t
+        seen |= counts
+
+def unique_rows(per_file):
+    """ deduplicated() for FileColumns, returns boolean mask per file """
+    seen = Counter()
+    ret = []
+    for columns in per_file:
+        counts = Counter()
+        keep = np.zeros(len(columns), dtype=bool)
+        for i, k in enumerate(columns.keys()):
+            counts[k] += 1
+            keep[i] = counts[k] > seen[k]
+        seen |= counts
+        ret.append(keep)
+    return ret
+
+def concatenate(per_file, masks):
+    """ Rows of FileColumns selected by boolean masks as one FileColumns """
+    ret = FileColumns(())
+    for name in ('date', 'cents', 'is_expense'):
+        setattr(ret, name, np.concatenate(
+            [getattr(ret, name)] +
+            [getattr(c, name)[m] for c, m in zip(per_file, masks)]))
+    for name in ('recipient', 'currency', 'verification', 'category'):
+        setattr(ret, name, [x for c, m in zip(per_file, masks)
+                            for x in compress(getattr(c, name), m)])
+    return ret
+
+def jobs_count(jobs, filenames):
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    return min(jobs, len(filenames))
+
+def read_files_separately(filenames, jobs = None, card_currency = base_currency):
+    """ Read all files in parallel. Returns FileColumns per file. """
+    jobs = jobs_count(jobs, filenames)
+    if jobs > 1:
+        # Workers inherit loaded categories instead of each loading them
+        if not transaction.categories:
+            transaction.load_categories()
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(partial(read_file,
+                                            card_currency=card_currency),
+                                    filenames))
+        for _, unknown, stats in results:
+            transaction.unknown.update(unknown)
+            transaction.cache.add_stats(stats)
+    else:
+        results = [read_file(filename, card_currency) for filename in filenames]
+    return [r[0] for r in results]
+
+def read_table(paths, jobs = None, card_currency = base_currency, fx = None):
+    """
+    Read all files and return date-sorted TransactionTable. A single file or
+    jobs == 1 streams transactions from readers straight into the table,
+    otherwise files are read in parallel and only their columns are sent
+    back. Amounts in foreign currencies are converted with money.FxTable fx.
+    """
+    filenames = expand(paths)
+    if jobs_count(jobs, filenames) <= 1:
+        if len(filenames) == 1:
+            transactions = iter_file(filenames[0], card_currency)
+        else:
+            transactions = deduplicated(iter_file(f, card_currency)
+                                        for f in filenames)
+        table = TransactionTable.from_transactions(transactions, fx)
+    else:
+        per_file = read_files_separately(filenames, jobs, card_currency)
+        c = concatenate(per_file, unique_rows(per_file))
+        table = TransactionTable.from_columns(c.date, c.cents, c.currency,
+                                              c.is_expense, c.category,
+                                              c.recipient, fx)
+    table.sort_by_date()
+    return table
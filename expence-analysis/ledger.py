@@ -0,0 +1,221 @@
+"""
+    ledger.py - local SQLite ledger of already ingested transactions.
+
+    Copyright (C) 2017 Evgenii Iuliugin
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import hashlib
+import json
+import sqlite3
+from collections import Counter
+
+import numpy as np
+
+import ingest
+import transaction
+from date_parser import to_datetime64
+from money import base_currency, to_base
+from transaction_table import SymbolTable, TransactionTable
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    sha1 TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    date TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    cents INTEGER NOT NULL,
+    is_expense INTEGER NOT NULL,
+    verification TEXT NOT NULL,
+    occurrence INTEGER NOT NULL,
+    category TEXT NOT NULL,
+    currency TEXT NOT NULL,
+    UNIQUE (date, recipient, cents, currency, is_expense, verification,
+            occurrence)
+);
+CREATE INDEX IF NOT EXISTS transactions_recipient ON transactions (recipient);
+CREATE TABLE IF NOT EXISTS recipients (
+    recipient TEXT PRIMARY KEY,
+    rule TEXT
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+def file_hash(filename):
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+class Ledger():
+    """
+    Transactions from all ingested exports together with their categories.
+    Files are parsed only once; the same rows from overlapping exports are
+    stored once.
+    """
+    def __init__(self, filename):
+        self.db = sqlite3.connect(filename)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def new_files(self, filenames):
+        """ Files that were not ingested yet or have changed since then """
+        ret = []
+        for filename in filenames:
+            sha1 = file_hash(filename)
+            row = self.db.execute("SELECT sha1 FROM files WHERE path = ?",
+                                  (filename,)).fetchone()
+            if row is None or row[0] != sha1:
+                ret.append((filename, sha1))
+        return ret
+
+    def ingest(self, paths, jobs = None, card_currency = base_currency):
+        """ Parse new files and append their rows. Returns number of new rows """
+        new = self.new_files(ingest.expand(paths))
+        if not new:
+            return 0
+
+        per_file = ingest.read_files_separately([f for f, _ in new], jobs,
+                                                card_currency)
+        before = self.count()
+        with self.db:
+            for (filename, sha1), columns in zip(new, per_file):
+                # n-th occurrence of the same row is the same transaction in
+                # every export it appears in
+                occurrences = Counter()
+                rows = []
+                for k, category in zip(columns.keys(), columns.category):
+                    occurrences[k] += 1
+                    date, recipient, cents, currency, is_expense, verification = k
+                    rows.append((date.isoformat(), recipient, cents,
+                                 int(is_expense),
+                                 '' if verification is None else str(verification),
+                                 occurrences[k], category, currency))
+                self.db.executemany("INSERT OR IGNORE INTO transactions VALUES "
+                                    "(?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                self.db.executemany(
+                    "INSERT OR IGNORE INTO recipients VALUES (?, ?)",
+                    ((r, transaction.resolve_rule(r)[1])
+                     for r in {r for r, e in zip(columns.recipient,
+                                                 columns.is_expense) if e}))
+                self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?)",
+                                (filename, sha1))
+        return self.count() - before
+
+    def count(self):
+        return self.db.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+
+    def affected_recipients(self, old_rules, new_rules):
+        """
+        Recipients whose category may differ between two rule sets returned
+        by transaction.rules(). Returns None if every recipient is affected.
+        """
+        old_exact, old_patterns = old_rules
+        new_exact, new_patterns = new_rules
+        old_patterns = [tuple(p) for p in old_patterns]
+        new_patterns = [tuple(p) for p in new_patterns]
+        old_set = set(old_patterns)
+        new_set = set(new_patterns)
+        if ([p for p in old_patterns if p in new_set] !=
+                [p for p in new_patterns if p in old_set]):
+            # Priority of unchanged patterns has changed
+            return None
+
+        changed_exact = {k for k in old_exact.keys() | new_exact.keys()
+                         if old_exact.get(k) != new_exact.get(k)}
+        removed = {line for line, _ in old_set - new_set}
+        added = [{'reobj': p['reobj'], 'name': p['name'], 'line': p['line']}
+                 for p in transaction.patterns
+                 if (p['line'], transaction.categories[p['name']]) not in old_set]
+        matcher = transaction.PatternMatcher(added)
+        added_names = {p['name'] for p in added}
+
+        ret = set()
+        for recipient, rule in self.db.execute("SELECT recipient, rule FROM "
+                                               "recipients"):
+            if (recipient in changed_exact or rule in changed_exact or
+                    rule in removed or recipient in added_names or
+                    matcher.match_index(recipient) is not None):
+                ret.add(recipient)
+        return ret
+
+    def update_categories(self, filename = "categories.txt",
+                          folder = 'categories'):
+        """
+        Re-categorise stored rows if category rules have changed. Only
+        recipients affected by changed rules are resolved again and only rows
+        whose category differs are updated. Returns number of updated rows.
+        """
+        signature = json.dumps(transaction.sources_signature(filename, folder))
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'categories'"
+                              ).fetchone()
+        if row is not None and row[0] == signature:
+            return 0
+
+        if not transaction.categories:
+            transaction.load_categories(filename, folder)
+        new_rules = transaction.rules()
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'rules'"
+                              ).fetchone()
+        affected = None
+        if row is not None:
+            affected = self.affected_recipients(json.loads(row[0]), new_rules)
+        if affected is None:
+            affected = [r for r, in self.db.execute(
+                "SELECT DISTINCT recipient FROM transactions WHERE is_expense = 1")]
+
+        updated = 0
+        with self.db:
+            for recipient in affected:
+                category, rule = transaction.resolve_rule(recipient)
+                updated += self.db.execute(
+                    "UPDATE transactions SET category = ? WHERE is_expense = 1 "
+                    "AND recipient = ? AND category != ?",
+                    (category, recipient, category)).rowcount
+                self.db.execute("INSERT OR REPLACE INTO recipients VALUES (?, ?)",
+                                (recipient, rule))
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES "
+                            "('categories', ?)", (signature,))
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('rules', ?)",
+                            (json.dumps(new_rules),))
+        return updated
+
+    def table(self, fx = None):
+        """
+        All stored transactions as TransactionTable. Amounts in foreign
+        currencies are converted with money.FxTable fx.
+        """
+        rows = self.db.execute("SELECT date, cents, is_expense, category, "
+                               "recipient, currency FROM transactions "
+                               "ORDER BY date").fetchall()
+        categories = SymbolTable()
+        recipients = SymbolTable()
+        date = to_datetime64([r[0] for r in rows], "%Y-%m-%d")
+        cents = np.array([r[1] for r in rows], dtype=np.int64)
+        return TransactionTable(
+            date,
+            to_base(date, [r[5] for r in rows], cents, fx),
+            np.array([r[2] for r in rows], dtype=bool),
+            np.array([categories.code(r[3]) for r in rows], dtype=np.int32),
+            np.array([recipients.code(r[4]) for r in rows], dtype=np.int32),
+            categories, recipients)
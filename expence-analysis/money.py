@@ -0,0 +1,121 @@
+"""
+    money.py - exact amounts and conversion between currencies.
+
+    Copyright (C) 2017 Evgenii Iuliugin
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import csv
+from decimal import Decimal, ROUND_HALF_EVEN
+
+import numpy as np
+
+from date_parser import parse_date
+
+# Amounts are stored as integer number of cents (fixed point with two
+# decimals) so sums are exact.
+SCALE = 100
+base_currency = 'SEK'
+
+def parse_amount(value):
+    """
+    Returns signed amount in cents. value is a number or a string with
+    optional comma thousands separators like "-1,234.50".
+    """
+    if isinstance(value, str):
+        value = Decimal(value.replace(',', '').strip())
+    elif isinstance(value, float):
+        # repr gives the shortest string that round-trips, i.e. "12.3" for 12.3
+        value = Decimal(repr(value))
+    else:
+        value = Decimal(value)
+    return int((value * SCALE).to_integral_value(rounding=ROUND_HALF_EVEN))
+
+class FxTable():
+    """
+    Daily exchange rates loaded from CSV file with "date,currency,rate"
+    lines, where rate is the price of one unit of currency in base currency.
+    Dates are in YYYY-MM-DD format. A date without a rate (weekend, holiday)
+    uses the latest earlier rate.
+    """
+    def __init__(self, filename = None, base = base_currency):
+        self.base = base
+        # rates[currency] = (sorted datetime64[D] dates, rates)
+        self.rates = {}
+        if filename is not None:
+            self.load(filename)
+
+    def load(self, filename):
+        per_currency = {}
+        with open(filename, 'r', encoding='utf-8', newline='') as f:
+            for row in csv.reader(f):
+                if len(row) < 3 or row[0].startswith('#'):
+                    continue
+                try:
+                    d = parse_date(row[0].strip(), "%Y-%m-%d")
+                except ValueError:
+                    # Header line
+                    continue
+                per_currency.setdefault(row[1].strip().upper(), {})[d] = float(row[2])
+
+        for currency, rates in per_currency.items():
+            dates = sorted(rates)
+            self.rates[currency] = (np.array(dates, dtype='datetime64[D]'),
+                                    np.array([rates[d] for d in dates]))
+
+    def rate_array(self, dates, currency):
+        if currency == self.base:
+            return np.ones(len(dates))
+        try:
+            rate_dates, rates = self.rates[currency]
+        except KeyError:
+            raise ValueError("No exchange rates for %s" % currency)
+        i = np.searchsorted(rate_dates, dates, side='right') - 1
+        if len(i) and i.min() < 0:
+            raise ValueError("No %s rate before %s"
+                             % (currency, dates[i < 0].min()))
+        return rates[i]
+
+    def convert(self, dates, currencies, cents):
+        """
+        Convert arrays of amounts in cents to base currency cents.
+        currencies is a sequence of currency codes, one per amount.
+        """
+        cents = np.asarray(cents, dtype=np.int64)
+        currencies = np.asarray(currencies)
+        ret = cents.copy()
+        for currency in np.unique(currencies):
+            if currency == self.base:
+                continue
+            rows = currencies == currency
+            ret[rows] = np.rint(cents[rows] *
+                                self.rate_array(dates[rows], currency))
+        return ret
+
+def to_base(dates, currencies, cents, fx = None):
+    """
+    Amounts in base currency units as float64 array. Every amount is converted
+    with the rate of its own date. fx may be omitted if all amounts are in
+    base currency.
+    """
+    cents = np.asarray(cents, dtype=np.int64)
+    if fx is not None:
+        cents = fx.convert(dates, currencies, cents)
+    else:
+        foreign = set(currencies) - {base_currency}
+        if foreign:
+            raise ValueError("Exchange rates are needed for %s, use --fx-rates"
+                             % ', '.join(sorted(foreign)))
+    return cents / SCALE
@@ -21,28 +21,102 @@
 import argparse
 import sys
 
-import expense_from_seb_csv
-import expense_from_seb_xlsx
-import expense_from_wirecard_xls
 import analyse
+import ingest
+import profiling
+from ledger import Ledger
+import transaction
+from money import FxTable, base_currency
 
 def mkenv():
     parser = argparse.ArgumentParser(add_help=True,
                                      description="Personal expense analysis.")
-    parser.add_argument("file", type=str, action="store",
-                        help="Path to file with expense data.")
+    parser.add_argument("files", type=str, nargs="+",
+                        help="Paths or glob patterns of files with expense " +
+                             "data. SEB xlsx/csv and Wirecard xls exports " +
+                             "are recognized automatically.")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="Number of files parsed in parallel. " +
+                             "Default is number of CPUs.")
+    parser.add_argument("--ledger", type=str, default=None,
+                        help="SQLite ledger with already ingested " +
+                             "transactions. Only new files are parsed and " +
+                             "all stored transactions are analysed.")
+    parser.add_argument("-g", "--granularity", type=str, default="month",
+                        choices=["week", "month", "quarter", "year"],
+                        help="Period used for comparative analysis.")
+    parser.add_argument("-w", "--window", type=int, default=None,
+                        help="Also show expenses during rolling periods " +
+                             "of this number of days.")
+    parser.add_argument("-o", "--output", type=str, default=None,
+                        help="Write charts to this directory instead of " +
+                             "showing them.")
+    parser.add_argument("--format", type=str, default="png",
+                        help="Comma separated list of report formats: " +
+                             "png, svg, html. Used with --output.")
+    parser.add_argument("--profile", type=str, default=None,
+                        help="Dump cProfile and tracemalloc statistics " +
+                             "for every stage to this directory.")
+    parser.add_argument("--fx-rates", type=str, default=None,
+                        help="CSV file with date,currency,rate lines used " +
+                             "to convert foreign amounts to SEK.")
+    parser.add_argument("--card-currency", type=str, default=base_currency,
+                        help="Currency of Wirecard card exports.")
+    parser.add_argument("--cache-stats", action="store_true",
+                        help="Print recipient category cache statistics.")
     parser.add_argument('--version', action='version', version='0.3')
     return parser.parse_args()
 
 def main():
     env = mkenv()
-    e = expense_from_seb_xlsx.expense_reader(env.file)
-    #e = expense_from_csv.expense_reader(env.file)
-    #e = expense_from_wirecard_xls.expense_reader(env.file)
-    e.sort(key=lambda x: x.date, reverse=False)
-    analyse.optimize(e)
-    analyse.category_analysis(e)
-    analyse.comparative_analysis(e)
+    fx = FxTable(env.fx_rates) if env.fx_rates else None
+    if env.profile:
+        profiling.enable(env.profile)
+
+    card_currency = env.card_currency.upper()
+    if env.ledger:
+        ledger = Ledger(env.ledger)
+        with profiling.stage('ingest'):
+            print("%d new transactions"
+                  % ledger.ingest(env.files, env.jobs, card_currency))
+        with profiling.stage('categorise'):
+            updated = ledger.update_categories()
+        if updated:
+            print("%d transactions re-categorised" % updated)
+        with profiling.stage('table'):
+            try:
+                table = ledger.table(fx)
+            except ValueError as error:
+                print(error)
+                return 1
+            finally:
+                ledger.close()
+    else:
+        with profiling.stage('ingest'):
+            try:
+                table = ingest.read_table(env.files, env.jobs, card_currency,
+                                          fx)
+            except ValueError as error:
+                print(error)
+                return 1
+    transaction.print_unknown_summary()
+    if env.cache_stats:
+        transaction.print_cache_summary()
+    with profiling.stage('aggregate'):
+        aggregation = analyse.optimize(table)
+    if env.output:
+        formats = [f.strip() for f in env.format.split(',') if f.strip()]
+        with profiling.stage('render'):
+            filenames = analyse.render_reports(aggregation, env.output,
+                                               formats, env.jobs, env.window)
+        for filename in filenames:
+            print("Written %s" % filename)
+        return 0
+    granularity = analyse.Granularity[env.granularity.capitalize()]
+    analyse.category_analysis(aggregation)
+    analyse.comparative_analysis(aggregation, granularity)
+    if env.window:
+        analyse.rolling_analysis(aggregation, env.window)
     return 0
 
 if __name__ == "__main__":
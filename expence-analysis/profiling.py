@@ -0,0 +1,65 @@
+"""
+    profiling.py - opt-in per-stage cProfile and tracemalloc dumps.
+
+    Copyright (C) 2017 Evgenii Iuliugin
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import cProfile
+import os
+import re
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Directory for profiles. Profiling is disabled if it is None.
+directory = None
+
+def enable(path):
+    global directory
+    directory = path
+    os.makedirs(directory, exist_ok=True)
+
+@contextmanager
+def stage(name):
+    """
+    Profile code inside the block if profiling is enabled. Writes
+    <name>.prof (cProfile, readable by pstats/snakeviz) and <name>.mem.txt
+    (top tracemalloc allocations) to the profile directory.
+    """
+    if directory is None:
+        yield
+        return
+
+    name = re.sub(r'[^\w.-]+', '_', name)
+    profile = cProfile.Profile()
+    tracemalloc.start()
+    start = time.perf_counter()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        elapsed = time.perf_counter() - start
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        profile.dump_stats(os.path.join(directory, name + '.prof'))
+        with open(os.path.join(directory, name + '.mem.txt'), 'w') as f:
+            f.write("time %.3fs, traced peak %.1f MiB, current %.1f MiB\n"
+                    % (elapsed, peak / 2**20, current / 2**20))
+            for stat in snapshot.statistics('lineno')[:25]:
+                f.write("%s\n" % stat)
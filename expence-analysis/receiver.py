@@ -0,0 +1,44 @@
+"""
+    receiver.py - split SEB receiver field into name and date.
+
+    Copyright (C) 2017 Evgenii Iuliugin
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import re
+from functools import lru_cache
+
+from date_parser import parse_date
+
+# Receiver is usually in "Name/YY-MM-DD" format. Name is followed by special
+# symbols that are dropped. '/' symbols can be in the middle of the name.
+receiver_re = re.compile(r'\s*(?P<name>.*?)[\W_]*'
+                         r'(?:/(?P<date>\d{1,2}-\d{1,2}-\d{1,2}))?\s*',
+                         re.DOTALL)
+junk_re = re.compile(r'\s*(?P<name>.*?)[\W_]*', re.DOTALL)
+
+@lru_cache(maxsize=65536)
+def normalize_receiver(receiver):
+    """
+    Returns (name, date). date is None if receiver has no valid date suffix.
+    """
+    m = receiver_re.fullmatch(receiver)
+    if m.group('date') is not None:
+        try:
+            return m.group('name'), parse_date(m.group('date'), "%y-%m-%d")
+        except ValueError:
+            # Looks like a date but isn't. It's part of the name then.
+            m = junk_re.fullmatch(receiver)
+    return m.group('name'), None
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+    rule-coverage.py - report how rules in categories.txt match transactions.
+
+    Copyright (C) 2017 Evgenii Iuliugin
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import sys
+from collections import Counter
+
+import numpy as np
+
+import ingest
+import transaction
+from ledger import Ledger
+from money import FxTable, base_currency
+
+def recipient_spend(table):
+    """ Returns {recipient: (transactions, amount)} for all expenses """
+    mask = table.is_expense
+    n = len(table.recipients)
+    counts = np.bincount(table.recipient[mask], minlength=n)
+    amounts = np.bincount(table.recipient[mask], weights=table.amount[mask],
+                          minlength=n)
+    return {table.recipients.names[i]: (int(counts[i]), float(amounts[i]))
+            for i in np.nonzero(counts)[0]}
+
+def coverage(spend):
+    """
+    Returns (rule index, overlaps). rule index maps rule to recipients it
+    categorised. overlaps[(winner, shadowed)] is number of recipients matched
+    by both wildcard rules where the first one wins.
+    """
+    index = {}
+    overlaps = Counter()
+    for recipient in spend:
+        category, rule = transaction.resolve_rule(recipient)
+        if rule is not None:
+            index.setdefault(rule, set()).add(recipient)
+        matching = [p['line'] for p in transaction.patterns
+                    if p['reobj'].match(recipient)]
+        winner = rule if rule is not None and rule not in matching else None
+        for line in matching:
+            if winner is None:
+                winner = line
+            elif line != winner:
+                overlaps[(winner, line)] += 1
+    return index, overlaps
+
+def static_overlaps():
+    """
+    Wildcard rules whose shortest matching name is also matched by an
+    earlier wildcard rule, i.e. rules that overlap regardless of data.
+    Wildcard lines dropped by read_categories because an earlier line
+    produced the same name are reported as well.
+    """
+    ret = []
+    patterns = transaction.patterns
+    for j, p in enumerate(patterns):
+        for i in range(j):
+            if patterns[i]['reobj'].match(p['name']):
+                ret.append((patterns[i]['line'], p['line']))
+                break
+
+    lines = transaction.matcher.lines
+    for key in transaction.categories:
+        if key in lines:
+            continue
+        if '*' in key:
+            name = key.replace('*', '')
+        elif '[' in key and ']' in key:
+            name = key.split('[')[0]
+        else:
+            continue
+        if name in lines:
+            ret.append((lines[name], key))
+    return ret
+
+def report(table, top):
+    spend = recipient_spend(table)
+    index, overlaps = coverage(spend)
+    exact, patterns = transaction.rules()
+    static = static_overlaps()
+    duplicates = {line for _, line in static}
+
+    def rule_spend(rule):
+        return sum(spend[r][1] for r in index.get(rule, ()))
+
+    dead = [(line, category) for line, category in patterns
+            if line not in index]
+    dead += [(name, category) for name, category in exact.items()
+             if name not in index and name not in duplicates]
+    print("Dead rules (%d):" % len(dead))
+    for rule, category in dead:
+        print("  [%s] %s" % (category, rule))
+
+    shadowed = {s for _, s in overlaps} - set(index)
+    print("\nOverlapping wildcard rules (%d):" % len(overlaps))
+    for (winner, line), count in overlaps.most_common():
+        print("  %-30s wins over %-30s for %d recipients%s"
+              % (winner, line, count,
+                 " (never wins)" if line in shadowed else ""))
+    for winner, line in static:
+        if (winner, line) not in overlaps:
+            print("  %-30s covers    %-30s" % (winner, line))
+
+    print("\nTop rules by spend:")
+    for rule in sorted(index, key=rule_spend, reverse=True)[:top]:
+        print("  %12.2f %4d recipients  %s"
+              % (rule_spend(rule), len(index[rule]), rule))
+
+    unknown = [(amount, count, r) for r, (count, amount) in spend.items()
+               if transaction.resolve_rule(r)[0] == "Unknown"]
+    unknown.sort(reverse=True)
+    print("\nTop unknown recipients by spend (%d total):" % len(unknown))
+    for amount, count, recipient in unknown[:top]:
+        print("  %12.2f %6d  %s" % (amount, count, recipient))
+
+def mkenv():
+    parser = argparse.ArgumentParser(add_help=True,
+                                     description="Category rules coverage.")
+    parser.add_argument("files", type=str, nargs="*",
+                        help="Paths or glob patterns of files with expense data.")
+    parser.add_argument("--ledger", type=str, default=None,
+                        help="Use transactions stored in SQLite ledger.")
+    parser.add_argument("-n", "--top", type=int, default=20,
+                        help="Number of rules and unknown recipients to show.")
+    parser.add_argument("-j", "--jobs", type=int, default=None)
+    parser.add_argument("--fx-rates", type=str, default=None,
+                        help="CSV file with date,currency,rate lines used " +
+                             "to convert foreign amounts to SEK.")
+    parser.add_argument("--card-currency", type=str, default=base_currency,
+                        help="Currency of Wirecard card exports.")
+    return parser.parse_args()
+
+def main():
+    env = mkenv()
+    fx = FxTable(env.fx_rates) if env.fx_rates else None
+    card_currency = env.card_currency.upper()
+    if env.ledger:
+        ledger = Ledger(env.ledger)
+        if env.files:
+            ledger.ingest(env.files, env.jobs, card_currency)
+        ledger.update_categories()
+        try:
+            table = ledger.table(fx)
+        except ValueError as error:
+            print(error)
+            return 1
+        finally:
+            ledger.close()
+    elif env.files:
+        try:
+            table = ingest.read_table(env.files, env.jobs, card_currency, fx)
+        except ValueError as error:
+            print(error)
+            return 1
+    else:
+        print("Either files or --ledger are required")
+        return 1
+    report(table, env.top)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -18,20 +18,30 @@
 
 """
 
+import os
 import re
 import glob
 import json
+import pickle
+import sys
+import tempfile
+from collections import Counter, OrderedDict
 from types import SimpleNamespace
 
+from money import SCALE, base_currency, parse_amount
+
 categories = {}
 patterns = []
+matcher = None
+unknown = Counter() # unknown[recipient] = number of transactions
 
 def read_categories(filename):
-    def add_pattern(ret, name, category, pattern_str):
+    def add_pattern(ret, name, category, pattern_str, line):
         global patterns
         pattern = {}
         pattern['reobj'] = re.compile(pattern_str)
         pattern['name'] = name
+        pattern['line'] = line
 
         if name in ret.keys():
             if ret[name] != category:
@@ -58,12 +68,14 @@ def read_categories(filename):
 
         if "*" in line:
             name = line.replace("*", "")
-            add_pattern(ret, name, category, line.replace("*", ".*") + "$")
+            add_pattern(ret, name, category, line.replace("*", ".*") + "$",
+                        line)
 
         if "[" in line and "]" in line:
             # TODO: error checks
             name = line.split("[")[0]
-            add_pattern(ret, name, category, line.replace("]", "]+") + "$")
+            add_pattern(ret, name, category, line.replace("]", "]+") + "$",
+                        line)
 
         if line in ret.keys():
             raise Exception("Duplicated recipient %s in %s" % (line, filename))
@@ -80,42 +92,265 @@ def read_extra_categories(folder: str) -> dict[str, str]:
                 ret[id] = c.category
     return ret
 
-def get_category(recipient):
+class PatternMatcher():
+    """
+    All wildcard and bracket rules compiled into alternations indexed by the
+    first literal character of the rule. Rules starting with a wildcard are
+    part of every bucket. Alternatives keep the order of categories.txt so the
+    first matching rule wins, exactly like a linear scan over patterns.
+    """
+    special = set('.^$*+?{}[]\\|()')
+
+    def __init__(self, patterns):
+        self.names = [p['name'] for p in patterns]
+        # Keys of categories that come from wildcard lines -> the line
+        self.lines = {}
+        for p in patterns:
+            self.lines.setdefault(p['name'], p['line'])
+            self.lines.setdefault(p['line'], p['line'])
+        alternatives = ['(?P<p%d>%s)' % (i, p['reobj'].pattern)
+                        for i, p in enumerate(patterns)]
+        buckets = {}
+        wildcards = []
+        for i, p in enumerate(patterns):
+            first = p['reobj'].pattern[:1]
+            if not first or first in self.special:
+                wildcards.append(i)
+                for b in buckets.values():
+                    b.append(i)
+            else:
+                if first not in buckets:
+                    buckets[first] = list(wildcards)
+                buckets[first].append(i)
+
+        def compile_bucket(bucket):
+            if not bucket:
+                return None
+            return re.compile('|'.join(alternatives[i] for i in bucket))
+
+        self.default = compile_bucket(wildcards)
+        self.index = {c: compile_bucket(b) for c, b in buckets.items()}
+
+    def match_index(self, recipient):
+        """ Returns index of the first matching rule in patterns or None """
+        reobj = self.index.get(recipient[:1], self.default)
+        if reobj is None:
+            return None
+        m = reobj.match(recipient)
+        if m is None:
+            return None
+        return int(m.lastgroup[1:])
+
+    def match(self, recipient):
+        """ Returns name of the first matching rule or None """
+        i = self.match_index(recipient)
+        return None if i is None else self.names[i]
+
+INDEX_VERSION = 2
+
+def sources_signature(filename, folder):
+    """ (path, mtime, size) for every file categories are read from """
+    sources = [filename] + sorted(glob.glob(f'{folder}/**.json'))
+    ret = []
+    for source in sources:
+        st = os.stat(source)
+        ret.append((source, st.st_mtime_ns, st.st_size))
+    return ret
+
+def load_categories(filename = "categories.txt", folder = 'categories',
+                    index_file = '.categories.idx'):
+    """
+    Read categories and patterns using on-disk index. The index is rebuilt
+    when any of the source files is added, removed or modified.
+    """
     global categories
     global patterns
+    global matcher
+
+    signature = sources_signature(filename, folder)
+    try:
+        with open(index_file, 'rb') as f:
+            index = pickle.load(f)
+        if index['version'] != INDEX_VERSION or index['sources'] != signature:
+            raise ValueError("Outdated index")
+        categories = index['categories']
+        patterns = [{'reobj': re.compile(pattern_str), 'name': name,
+                     'line': line}
+                    for name, pattern_str, line in index['patterns']]
+    except (OSError, ValueError, KeyError, pickle.UnpicklingError, EOFError):
+        patterns = []
+        categories = read_categories(filename)
+        categories.update(read_extra_categories(folder))
 
+        index = {'version': INDEX_VERSION, 'sources': signature,
+                 'categories': categories,
+                 'patterns': [(p['name'], p['reobj'].pattern, p['line'])
+                              for p in patterns]}
+        try:
+            # Own temporary file, other processes may rebuild the index too
+            fd, tmp = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(index_file)),
+                suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+                umask = os.umask(0)
+                os.umask(umask)
+                os.chmod(tmp, 0o666 & ~umask)
+                os.replace(tmp, index_file)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+        except OSError as e:
+            print("Can't write category index %s: %s" % (index_file, e))
+
+    matcher = PatternMatcher(patterns)
+
+def resolve_rule(recipient):
+    """
+    Returns (category, rule). rule is the line of categories file (or JSON
+    id) that gave the category, None for accounts and unknown recipients.
+    """
     if not categories:
-        categories = read_categories("categories.txt")
-        categories.update(read_extra_categories('categories'))
+        load_categories()
 
     if recipient.isdigit():
-        return "Account"
+        return "Account", None
 
-    ret = "Unknown"
     try:
-        ret = categories[recipient]
+        category = categories[recipient]
     except KeyError:
-        for p in patterns:
-            if p['reobj'].match(recipient):
-                return categories[p['name']]
+        i = matcher.match_index(recipient)
+        if i is not None:
+            return categories[patterns[i]['name']], patterns[i]['line']
+        return "Unknown", None
+    # Names produced from wildcard lines belong to the wildcard rule
+    return category, matcher.lines.get(recipient, recipient)
 
-        print("Unknow category: %s" % recipient)
-    return ret
+def rules():
+    """
+    Current rules in order of priority: exact names first, then patterns.
+    Returns ({name: category}, [(line, category), ...]).
+    """
+    if not categories:
+        load_categories()
+    exact = {k: v for k, v in categories.items() if k not in matcher.lines}
+    return exact, [(p['line'], categories[p['name']]) for p in patterns]
+
+class CategoryCache():
+    """
+    Bounded LRU cache for recipient -> category. Unknown recipients are cached
+    as well so they are not matched against all the rules again.
+    """
+    def __init__(self, maxsize = 4096):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.other_size = 0 # entries in caches of worker processes
+
+    def get(self, recipient):
+        try:
+            category = self.data[recipient]
+        except KeyError:
+            self.misses += 1
+            category = resolve_rule(recipient)[0]
+            self.data[recipient] = category
+            if len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+                self.evictions += 1
+        else:
+            self.hits += 1
+            self.data.move_to_end(recipient)
+        return category
+
+    def clear(self):
+        self.data.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.other_size = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self.data) + self.other_size,
+                'hit_rate': self.hits / total if total else 0.}
+
+    def add_stats(self, stats):
+        """ Accumulate counters reported by a cache in another process """
+        self.hits += stats['hits']
+        self.misses += stats['misses']
+        self.evictions += stats['evictions']
+        self.other_size += stats['size']
+
+cache = CategoryCache()
+
+def get_category(recipient):
+    category = cache.get(recipient)
+    if category == "Unknown":
+        unknown[recipient] += 1
+    return category
+
+def print_unknown_summary():
+    """ Report every unknown recipient once with number of transactions """
+    if not unknown:
+        return
+    print("Unknown categories (%d recipients, %d transactions):"
+          % (len(unknown), sum(unknown.values())))
+    for recipient, count in unknown.most_common():
+        print("  %6d  %s" % (count, recipient))
+
+def print_cache_summary():
+    s = cache.stats()
+    print("Category cache: %d hits, %d misses, %d evictions, %d entries"
+          " (hit rate %.1f%%)" % (s['hits'], s['misses'], s['evictions'],
+                                   s['size'], 100. * s['hit_rate']))
 
 def str2number(num_str):
-    return float(num_str.replace(',', ''))
+    return parse_amount(num_str) / SCALE
 
 class Transaction:
-    def __init__(self, date, recipient, amount):
+    # Slots instead of per-instance dict. Recipient and category strings are
+    # interned, so transactions with the same merchant share them.
+    # Amount is kept as exact number of cents in its own currency.
+    __slots__ = ('date', 'recipient', 'cents', 'currency', 'is_expense',
+                 'verification', '_category')
+
+    def __init__(self, date, recipient, amount, verification = None,
+                 currency = base_currency):
         self.date = date
+        self.verification = verification
 
-        if type(amount) == str:
-            amount = str2number(amount)
-        self.amount = abs(amount)
-        self.is_expense = amount < 0
+        cents = parse_amount(amount)
+        self.cents = abs(cents)
+        self.is_expense = cents < 0
+        self.currency = sys.intern(currency)
 
-        self.recipient = recipient
-        if self.is_expense:
-            self.category = get_category(recipient)
-        else:
-            self.category = "Refill"
+        self.recipient = sys.intern(recipient)
+        # Resolved on first access
+        self._category = None
+
+    @property
+    def amount(self):
+        return self.cents / SCALE
+
+    @property
+    def category(self):
+        if self._category is None:
+            if self.is_expense:
+                self._category = sys.intern(get_category(self.recipient))
+            else:
+                self._category = "Refill"
+        return self._category
+
+    @category.setter
+    def category(self, category):
+        self._category = category
+
+    def key(self):
+        """ Identifies the same transaction in overlapping exports """
+        return (self.date, self.recipient, self.cents, self.currency,
+                self.is_expense, self.verification)
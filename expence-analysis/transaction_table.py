@@ -0,0 +1,133 @@
+"""
+    transaction_table.py - columnar storage for transactions.
+
+    Copyright (C) 2017 Evgenii Iuliugin
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+
+from money import to_base
+
+class SymbolTable():
+    """ Interns strings as integer codes """
+    def __init__(self):
+        self.codes = {}
+        self.names = []
+
+    def __len__(self):
+        return len(self.names)
+
+    def code(self, name):
+        try:
+            return self.codes[name]
+        except KeyError:
+            self.codes[name] = len(self.names)
+            self.names.append(name)
+            return self.codes[name]
+
+class TransactionTable():
+    """
+    Transactions stored column by column:
+      date       - datetime64[D]
+      amount     - float64 in base currency, always positive
+      is_expense - bool
+      category   - int32 code in self.categories
+      recipient  - int32 code in self.recipients
+    """
+    def __init__(self, date, amount, is_expense, category, recipient,
+                 categories, recipients):
+        self.date = date
+        self.amount = amount
+        self.is_expense = is_expense
+        self.category = category
+        self.recipient = recipient
+        self.categories = categories
+        self.recipients = recipients
+
+    @classmethod
+    def from_transactions(cls, transactions, fx = None):
+        """
+        Builds table from any iterable of transactions. Transactions are
+        consumed one by one, so readers may yield them lazily. Amounts in
+        foreign currencies are converted with money.FxTable fx.
+        """
+        categories = SymbolTable()
+        recipients = SymbolTable()
+        date = []
+        cents = []
+        currency = []
+        is_expense = []
+        category = []
+        recipient = []
+        for t in transactions:
+            date.append(t.date)
+            cents.append(t.cents)
+            currency.append(t.currency)
+            is_expense.append(t.is_expense)
+            category.append(categories.code(t.category))
+            recipient.append(recipients.code(t.recipient))
+        date = np.array(date, dtype='datetime64[D]')
+        return cls(date,
+                   to_base(date, currency, cents, fx),
+                   np.array(is_expense, dtype=bool),
+                   np.array(category, dtype=np.int32),
+                   np.array(recipient, dtype=np.int32),
+                   categories, recipients)
+
+    @classmethod
+    def from_columns(cls, date, cents, currency, is_expense, category,
+                     recipient, fx = None):
+        """
+        Builds table from datetime64[D] date, int64 cents and bool is_expense
+        arrays and sequences of currency, category and recipient strings.
+        """
+        categories = SymbolTable()
+        recipients = SymbolTable()
+        return cls(date,
+                   to_base(date, currency, cents, fx),
+                   np.asarray(is_expense, dtype=bool),
+                   np.array([categories.code(c) for c in category],
+                            dtype=np.int32),
+                   np.array([recipients.code(r) for r in recipient],
+                            dtype=np.int32),
+                   categories, recipients)
+
+    def __len__(self):
+        return len(self.date)
+
+    def sort_by_date(self):
+        order = np.argsort(self.date, kind='stable')
+        self.date = self.date[order]
+        self.amount = self.amount[order]
+        self.is_expense = self.is_expense[order]
+        self.category = self.category[order]
+        self.recipient = self.recipient[order]
+
+    def category_code(self, name):
+        """ Returns code of the category or -1 if there is no such category """
+        return self.categories.codes.get(name, -1)
+
+    def expenses(self, skip_account_transfers = True):
+        """ Boolean mask of expenses """
+        mask = self.is_expense.copy()
+        if skip_account_transfers:
+            mask &= self.category != self.category_code('Account')
+        return mask
+
+    def category_totals(self, mask):
+        """ totals[code] - amount for category with given code """
+        return np.bincount(self.category[mask], weights=self.amount[mask],
+                           minlength=len(self.categories))
@@ -0,0 +1,162 @@
+import gzip
+import http.client
+import threading
+import time
+import urllib.error
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+user_agent = 'runstenar/1.0 (+https://github.com/yulyugin/helpers)'
+
+class HostRateLimiter():
+    """ Spaces out requests to the same host by at least 1 / rate seconds """
+    def __init__(self, rate = None):
+        self.interval = 1. / rate if rate else 0.
+        self.lock = threading.Lock()
+        self.next = {} # next[host] = earliest time of the next request
+
+    def wait(self, host):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next.get(host, now))
+            self.next[host] = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+class Response():
+    def __init__(self, url, status, reason, headers, body):
+        self.url = url # final URL after redirects
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+class Crawler():
+    """
+    Fetches pages from a pool of worker threads. Every worker keeps one
+    keep-alive connection per host. Failed connections and temporary server
+    errors are retried with exponential backoff.
+    """
+    retry_statuses = (429, 502, 503, 504)
+    max_redirects = 5
+
+    def __init__(self, jobs = 8, rate = None, retries = 3, backoff = 1.,
+                 timeout = 30):
+        self.jobs = jobs
+        self.limiter = HostRateLimiter(rate)
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.local = threading.local()
+        self.executor = None
+
+    def __enter__(self):
+        self.executor = ThreadPoolExecutor(max_workers=self.jobs)
+        return self
+
+    def __exit__(self, *args):
+        self.executor.shutdown()
+        self.executor = None
+
+    def connection(self, scheme, netloc):
+        if not hasattr(self.local, 'connections'):
+            self.local.connections = {}
+        key = (scheme, netloc)
+        conn = self.local.connections.get(key)
+        if conn is None:
+            cls = http.client.HTTPSConnection if scheme == 'https' \
+                  else http.client.HTTPConnection
+            conn = cls(netloc, timeout=self.timeout)
+            self.local.connections[key] = conn
+        return conn
+
+    def drop_connection(self, scheme, netloc):
+        conn = self.local.connections.pop((scheme, netloc), None)
+        if conn is not None:
+            conn.close()
+
+    def request(self, url, headers = None):
+        """ One GET request following redirects. Returns Response. """
+        for _ in range(self.max_redirects + 1):
+            parts = urllib.parse.urlsplit(url)
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+            request_headers = {'User-Agent': user_agent,
+                               'Accept-Encoding': 'gzip'}
+            request_headers.update(headers or {})
+
+            self.limiter.wait(parts.netloc)
+            conn = self.connection(parts.scheme, parts.netloc)
+            try:
+                conn.request('GET', path, headers=request_headers)
+                r = conn.getresponse()
+                body = r.read()
+            except (OSError, http.client.HTTPException):
+                self.drop_connection(parts.scheme, parts.netloc)
+                raise
+            if r.will_close:
+                self.drop_connection(parts.scheme, parts.netloc)
+            if r.getheader('Content-Encoding') == 'gzip':
+                body = gzip.decompress(body)
+
+            location = r.getheader('Location')
+            if r.status in (301, 302, 303, 307, 308) and location:
+                url = urllib.parse.urljoin(url, location)
+                continue
+            return Response(url, r.status, r.reason, r.headers, body)
+        raise urllib.error.HTTPError(url, r.status, "Too many redirects",
+                                     r.headers, None)
+
+    def delay(self, attempt, response):
+        if response is not None:
+            retry_after = response.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                return float(retry_after)
+        return self.backoff * 2 ** attempt
+
+    def get(self, url, headers = None, ok = (200,)):
+        """
+        Returns Response, retrying connection errors and retry_statuses.
+        Raises urllib.error.HTTPError if final status is not in ok.
+        """
+        for attempt in range(self.retries + 1):
+            response = None
+            try:
+                response = self.request(url, headers)
+            except urllib.error.HTTPError:
+                # Too many redirects. HTTPError is an OSError too, but it is
+                # not a connection failure worth retrying.
+                raise
+            except (OSError, http.client.HTTPException):
+                if attempt == self.retries:
+                    raise
+            else:
+                if response.status not in self.retry_statuses:
+                    break
+            if attempt < self.retries:
+                time.sleep(self.delay(attempt, response))
+
+        if response.status not in ok:
+            raise urllib.error.HTTPError(url, response.status, response.reason,
+                                         response.headers, None)
+        return response
+
+    def fetch(self, url):
+        """ Page body as bytes, the same as urlopen(url).read() """
+        return self.get(url).body
+
+    def map(self, function, iterable):
+        """ function applied to every item in the pool, results in order """
+        if self.executor is None:
+            return [function(i) for i in iterable]
+        return list(self.executor.map(function, iterable))
+
+    def fetch_all(self, urls):
+        return self.map(self.fetch, urls)
+
+    def finish(self):
+        """ Called after all pages of a crawl have been fetched """
+        pass
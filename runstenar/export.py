@@ -0,0 +1,233 @@
+#!/usr/bin/python3
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from xml.sax.saxutils import escape
+
+import numpy as np
+
+from geodata import Stones, statuses, unknown_status
+
+# Viking waypoint colours of status layers, the same as in dumps/*.vik
+layer_colors = {'Lost or destroyed': '#000000', 'In church': '#ffff00',
+                'In museum': '#0000ff', 'Alive': '#00ff00', None: '#808080'}
+# Order of layers in .vik files
+layer_order = ['Lost or destroyed', 'In church', 'In museum', 'Alive', None]
+
+vik_header = """#VIKING GPS Data file http://viking.sf.net/
+FILE_VERSION=1
+
+xmpp=256.000000
+ympp=256.000000
+lat=%f
+lon=%f
+mode=mercator
+color=#cccccc
+highlightcolor=#eea500
+drawscale=t
+drawcentermark=t
+drawhighlight=t
+
+~Layer Map
+name=Default Map
+mode=13
+directory=
+cache_type=1
+mapfile=
+alpha=255
+autodownload=t
+adlonlymissing=f
+mapzoom=0
+~EndLayer
+
+
+"""
+
+vik_layer = """~Layer TrackWaypoint
+name=%s
+tracks_visible=t
+waypoints_visible=t
+routes_visible=t
+trackdrawlabels=t
+trackfontsize=3
+drawmode=0
+trackcolor=#000000
+drawlines=t
+line_thickness=1
+drawdirections=f
+trkdirectionsize=5
+drawpoints=t
+trkpointsize=2
+drawelevation=f
+elevation_factor=30
+drawstops=f
+stop_length=60
+bg_line_thickness=0
+trackbgcolor=#ffffff
+speed_factor=30.000000
+tracksortorder=0
+drawlabels=t
+wpfontsize=3
+wpcolor=%s
+wptextcolor=#ffffff
+wpbgcolor=%s
+wpbgand=f
+wpsymbol=0
+wpsize=4
+wpsyms=t
+wpsortorder=0
+drawimages=t
+image_size=64
+image_alpha=255
+image_cache_size=300
+metadatadesc=
+metadataauthor=
+metadatatime=%s
+metadatakeywords=
+
+
+~LayerData
+type="waypointlist"
+%s\
+type="waypointlistend"
+~EndLayerData
+~EndLayer
+
+
+"""
+
+waypoint_template = "type=\"waypoint\" latitude=\"%.15f\" longitude=\"%.15f\" name=\"%s\" comment=\"Source: %s\"\n"
+
+def status_mask(stones, status):
+    code = statuses.index(status) if status is not None else unknown_status
+    return stones.status == code
+
+def waypoints(stones, mask = None):
+    """ type="waypoint" lines for stones selected by boolean mask """
+    indices = np.flatnonzero(mask) if mask is not None else range(len(stones))
+    coordinates = stones.coordinates.tolist()
+    return ''.join([waypoint_template % (coordinates[i][0], coordinates[i][1],
+                                         stones.names[i], stones.sources[i])
+                    for i in indices])
+
+def vik(stones):
+    """ Complete Viking file with one TrackWaypoint layer per status """
+    center = stones.coordinates.mean(axis=0) if len(stones) else (0., 0.)
+    now = time.strftime('%Y-%m-%dT%H:%M:%S.000000Z', time.gmtime())
+    parts = [vik_header % (center[0], center[1])]
+    for status in layer_order:
+        mask = status_mask(stones, status)
+        if mask.any():
+            color = layer_colors[status]
+            parts.append(vik_layer % (status or 'Unknown', color, color, now,
+                                      waypoints(stones, mask)))
+    # Viking ends file with one empty line after the last layer
+    return ''.join(parts).rstrip('\n') + '\n\n'
+
+def gpx(stones):
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n'
+             '<gpx version="1.1" creator="runstenar" '
+             'xmlns="http://www.topografix.com/GPX/1/1">\n']
+    coordinates = stones.coordinates.tolist()
+    for i, (lat, lon) in enumerate(coordinates):
+        status = stones.status_name(i)
+        parts.append(' <wpt lat="%.15f" lon="%.15f">\n'
+                     '  <name>%s</name>\n'
+                     '  <cmt>Source: %s</cmt>\n'
+                     '%s'
+                     ' </wpt>\n'
+                     % (lat, lon, escape(stones.names[i]),
+                        escape(stones.sources[i]),
+                        '  <type>%s</type>\n' % escape(status) if status else ''))
+    parts.append('</gpx>\n')
+    return ''.join(parts)
+
+def geojson(stones):
+    coordinates = stones.coordinates.tolist()
+    features = [{'type': 'Feature',
+                 'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+                 'properties': {'name': stones.names[i],
+                                'status': stones.status_name(i),
+                                'source': stones.sources[i]}}
+                for i, (lat, lon) in enumerate(coordinates)]
+    return json.dumps({'type': 'FeatureCollection', 'features': features},
+                      ensure_ascii=False, separators=(',', ':')) + '\n'
+
+formats = {'.vik': vik, '.gpx': gpx, '.geojson': geojson}
+
+def write(filename, text):
+    """
+    Write whole text at once to a temporary file next to filename and
+    rename it, so readers never see a partially written file.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+        # mkstemp creates owner-only files, use mode of a file made by open()
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp, 0o666 & ~umask)
+        os.replace(tmp, filename)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+def export(stones, filename):
+    """ Write stones in format given by extension of filename """
+    extension = os.path.splitext(filename)[1].lower()
+    try:
+        formatter = formats[extension]
+    except KeyError:
+        raise ValueError("Unknown output format %s" % filename)
+    write(filename, formatter(stones))
+
+def write_status_files(stones, filenames):
+    """ Scraper outputs: filenames[status] gets waypoint lines of that status """
+    for status, filename in filenames.items():
+        write(filename, waypoints(stones, status_mask(stones, status)))
+
+def from_merged(filename):
+    """ Stones from merged.json written by merge.py """
+    with open(filename, 'r', encoding='utf-8') as f:
+        records = json.load(f)
+    return Stones.from_records(
+        (r['name'], r['latitude'], r['longitude'],
+         r['records'][0]['url'] if r['records'] else '', r['status'])
+        for r in records)
+
+def add_arguments(parser):
+    parser.add_argument("-o", "--output", type=str, action="append",
+                        default=[],
+                        help="Also write all stones to this file. Format is " +
+                             "taken from extension: .vik, .gpx or .geojson. " +
+                             "May be repeated.")
+
+def mkenv():
+    parser = argparse.ArgumentParser(add_help=True,
+                                     description="Convert rune stones to " +
+                                                 "Viking, GPX and GeoJSON files.")
+    parser.add_argument("files", type=str, nargs="+",
+                        help="merged.json from merge.py or .kml, .vik and " +
+                             "scraper .txt files.")
+    add_arguments(parser)
+    return parser.parse_args()
+
+def main():
+    env = mkenv()
+    if len(env.files) == 1 and env.files[0].endswith('.json'):
+        stones = from_merged(env.files[0])
+    else:
+        stones = Stones.load(env.files)
+    for filename in env.output:
+        export(stones, filename)
+        print("Written %d stones to %s" % (len(stones), filename))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
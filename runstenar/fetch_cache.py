@@ -0,0 +1,154 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+
+from crawler import Crawler
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    url TEXT PRIMARY KEY,
+    sha1 TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT
+);
+CREATE TABLE IF NOT EXISTS checkpoint (
+    crawl TEXT NOT NULL,
+    url TEXT NOT NULL,
+    PRIMARY KEY (crawl, url)
+);
+"""
+
+class ResponseCache():
+    """
+    Page bodies stored once per content under objects/ and indexed by URL
+    together with validators for conditional requests. URLs completed in
+    the current crawl are kept in checkpoint until finish() is called, so an
+    interrupted crawl doesn't fetch them again. Checkpoints of crawls with
+    different names sharing the cache are independent.
+    """
+    def __init__(self, directory, crawl = ''):
+        self.directory = directory
+        self.crawl = crawl
+        os.makedirs(os.path.join(directory, 'objects'), exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(directory, 'index.db'),
+                                  check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def object_path(self, sha1):
+        return os.path.join(self.directory, 'objects', sha1[:2], sha1)
+
+    def entry(self, url):
+        """ Returns (sha1, etag, last_modified, done) or None """
+        with self.lock:
+            row = self.db.execute("SELECT sha1, etag, last_modified FROM "
+                                  "responses WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                return None
+            done = self.db.execute("SELECT 1 FROM checkpoint WHERE crawl = ? "
+                                   "AND url = ?",
+                                   (self.crawl, url)).fetchone() is not None
+        return row + (done,)
+
+    def body(self, sha1):
+        with open(self.object_path(sha1), 'rb') as f:
+            return f.read()
+
+    def put(self, url, body, etag = None, last_modified = None):
+        sha1 = hashlib.sha1(body).hexdigest()
+        path = self.object_path(sha1)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as f:
+                f.write(body)
+            os.replace(tmp, path)
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO responses VALUES "
+                            "(?, ?, ?, ?)", (url, sha1, etag, last_modified))
+            self.db.execute("INSERT OR IGNORE INTO checkpoint VALUES (?, ?)",
+                            (self.crawl, url))
+        return sha1
+
+    def done(self, url):
+        """ Mark URL whose cached response is still valid as completed """
+        with self.lock, self.db:
+            self.db.execute("INSERT OR IGNORE INTO checkpoint VALUES (?, ?)",
+                            (self.crawl, url))
+
+    def finish(self):
+        """ Crawl is complete, next one revalidates every page """
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM checkpoint WHERE crawl = ?",
+                            (self.crawl,))
+
+class CachedCrawler(Crawler):
+    """
+    Crawler that keeps responses in ResponseCache. Pages completed by an
+    interrupted crawl are not requested again, other cached pages are
+    revalidated with If-None-Match/If-Modified-Since.
+    """
+    def __init__(self, cache, *args, **kwargs):
+        super(CachedCrawler, self).__init__(*args, **kwargs)
+        self.cache = cache
+        self.hits = 0 # served without request
+        self.not_modified = 0 # revalidated with 304
+
+    def fetch(self, url):
+        entry = self.cache.entry(url)
+        if entry is None:
+            headers = {}
+        else:
+            sha1, etag, last_modified, done = entry
+            if done:
+                self.hits += 1
+                return self.cache.body(sha1)
+            headers = {}
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        r = self.get(url, headers, ok=(200, 304))
+        if r.status == 304:
+            self.not_modified += 1
+            self.cache.done(url)
+            return self.cache.body(sha1)
+        self.cache.put(url, r.body, r.headers.get('ETag'),
+                       r.headers.get('Last-Modified'))
+        return r.body
+
+    def finish(self):
+        self.cache.finish()
+        print("%d pages from interrupted crawl, %d not modified"
+              % (self.hits, self.not_modified))
+
+def crawler(env, crawl):
+    """
+    Crawler configured by --cache, --jobs, --rate and --retries. crawl names
+    the checkpoint of this crawl in the cache.
+    """
+    if env.cache:
+        cache = ResponseCache(env.cache, crawl)
+        if env.restart:
+            cache.finish()
+        return CachedCrawler(cache, env.jobs, env.rate, env.retries)
+    return Crawler(env.jobs, env.rate, env.retries)
+
+def add_arguments(parser):
+    parser.add_argument("-j", "--jobs", type=int, default=8,
+                        help="Number of pages fetched in parallel.")
+    parser.add_argument("--rate", type=float, default=None,
+                        help="Maximum number of requests per second.")
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--cache", type=str, default=".cache",
+                        help="Directory with cached pages. Empty string " +
+                             "disables the cache.")
+    parser.add_argument("--restart", action="store_true",
+                        help="Ignore progress of an interrupted crawl.")
@@ -0,0 +1,241 @@
+#!/usr/bin/python3
+
+import argparse
+import math
+import os
+import re
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+earth_radius = 6371.0088 # km
+
+# Layer names used in dumps/*.vik
+statuses = ['Alive', 'Lost or destroyed', 'In museum', 'In church']
+unknown_status = -1
+
+# Statuses of waypoints in live.txt, dead.txt, ... written by the scrapers
+file_statuses = {'live': 'Alive', 'dead': 'Lost or destroyed',
+                 'museum': 'In museum', 'church': 'In church'}
+
+waypoint_re = re.compile(r'(\w+)="([^"]*)"')
+objektid_re = re.compile(r'href="([^"]*objektid=\d+)"')
+
+def iter_vik(filename):
+    """
+    Yields (name, latitude, longitude, source, status) for every
+    type="waypoint" line. Status is the name of the enclosing TrackWaypoint
+    layer. Files written by the scrapers have no layers, their status comes
+    from the file name.
+    """
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    layer = file_statuses.get(stem)
+    in_layer_header = False
+    with open(filename, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.startswith('type="waypoint" '):
+                fields = dict(waypoint_re.findall(line))
+                source = fields.get('comment', '')
+                if source.startswith('Source: '):
+                    source = source[len('Source: '):]
+                yield (fields.get('name', ''), float(fields['latitude']),
+                       float(fields['longitude']), source, layer)
+            elif line.startswith('~Layer '):
+                in_layer_header = True
+                layer = None
+            elif in_layer_header and line.startswith('name='):
+                layer = line[len('name='):].rstrip('\n')
+                in_layer_header = False
+
+def iter_kml(filename):
+    """
+    Yields (name, latitude, longitude, source, None) for every Placemark
+    with a Point. The file is parsed incrementally and every handled
+    Placemark is dropped from the tree.
+    """
+    for event, elem in ET.iterparse(filename, events=('end',)):
+        if not elem.tag.endswith('}Placemark') and elem.tag != 'Placemark':
+            continue
+        name = ''
+        coordinates = None
+        source = ''
+        for child in elem.iter():
+            tag = child.tag.rsplit('}', 1)[-1]
+            if tag == 'name':
+                name = (child.text or '').strip()
+            elif tag == 'coordinates':
+                coordinates = child.text
+            elif tag == 'description':
+                m = objektid_re.search(child.text or '')
+                if m:
+                    source = m.group(1)
+        elem.clear()
+        if coordinates:
+            lon, lat = coordinates.strip().split(',')[:2]
+            yield name, float(lat), float(lon), source, None
+
+def iter_file(filename):
+    if filename.lower().endswith('.kml'):
+        return iter_kml(filename)
+    return iter_vik(filename)
+
+class Stones():
+    """
+    Rune stones stored column by column:
+      coordinates - float64 (n, 2) array of latitude, longitude in degrees
+      status      - int8 index in statuses or unknown_status
+      names, sources - lists of strings
+    """
+    def __init__(self, coordinates, status, names, sources):
+        self.coordinates = coordinates
+        self.status = status
+        self.names = names
+        self.sources = sources
+
+    @classmethod
+    def load(cls, filenames):
+        return cls.from_records(record for filename in filenames
+                                for record in iter_file(filename))
+
+    @classmethod
+    def from_records(cls, records):
+        """ records are (name, latitude, longitude, source, status) """
+        coordinates = []
+        status = []
+        names = []
+        sources = []
+        codes = {s: i for i, s in enumerate(statuses)}
+        for name, lat, lon, source, layer in records:
+            coordinates.append((lat, lon))
+            status.append(codes.get(layer, unknown_status))
+            names.append(name)
+            sources.append(source)
+        return cls(np.array(coordinates, dtype=np.float64).reshape(-1, 2),
+                   np.array(status, dtype=np.int8), names, sources)
+
+    def __len__(self):
+        return len(self.names)
+
+    def status_name(self, i):
+        return statuses[self.status[i]] if self.status[i] >= 0 else None
+
+def haversine(lat, lon, lats, lons):
+    """
+    Distance in km from (lat, lon) to every point of lats, lons. lat, lon
+    may be arrays too, then distances between corresponding points are
+    returned.
+    """
+    lat, lon = np.radians(lat), np.radians(lon)
+    lats, lons = np.radians(lats), np.radians(lons)
+    a = (np.sin((lats - lat) / 2) ** 2 +
+         np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2)
+    return 2 * earth_radius * np.arcsin(np.sqrt(np.minimum(a, 1.)))
+
+class GridIndex():
+    """
+    Points bucketed into a latitude/longitude grid of roughly cell_km
+    cells. Queries look only at cells intersecting the bounding box of the
+    search circle and compute exact great-circle distances for points in
+    them.
+    """
+    def __init__(self, coordinates, cell_km = 2.):
+        self.lat = np.ascontiguousarray(coordinates[:, 0])
+        self.lon = np.ascontiguousarray(coordinates[:, 1])
+        self.cell_km = cell_km
+        mean_lat = float(self.lat.mean()) if len(self.lat) else 0.
+        self.cell_lat = math.degrees(cell_km / earth_radius)
+        self.cell_lon = self.cell_lat / max(math.cos(math.radians(mean_lat)),
+                                            1e-6)
+
+        # Points sorted by cell, cells[(row, column)] = (start, end)
+        rows = np.floor(self.lat / self.cell_lat).astype(np.int64)
+        columns = np.floor(self.lon / self.cell_lon).astype(np.int64)
+        self.order = np.lexsort((columns, rows))
+        keys = np.stack((rows[self.order], columns[self.order]), axis=1)
+        self.cells = {}
+        if len(keys):
+            bounds = np.flatnonzero((keys[1:] != keys[:-1]).any(axis=1)) + 1
+            starts = np.concatenate(([0], bounds))
+            ends = np.concatenate((bounds, [len(keys)]))
+            for start, end in zip(starts.tolist(), ends.tolist()):
+                self.cells[tuple(keys[start].tolist())] = (start, end)
+
+    def candidates(self, lat, lon, radius):
+        """ Indices of points in cells intersecting the circle's bounding box """
+        dlat = math.degrees(radius / earth_radius)
+        s = math.sin(radius / earth_radius) / max(math.cos(math.radians(lat)),
+                                                  1e-12)
+        dlon = math.degrees(math.asin(s)) if s < 1 else 180.
+        row0 = math.floor((lat - dlat) / self.cell_lat)
+        row1 = math.floor((lat + dlat) / self.cell_lat)
+        column0 = math.floor((lon - dlon) / self.cell_lon)
+        column1 = math.floor((lon + dlon) / self.cell_lon)
+        if (row1 - row0 + 1) * (column1 - column0 + 1) > len(self.cells):
+            return self.order
+        slices = []
+        for row in range(row0, row1 + 1):
+            for column in range(column0, column1 + 1):
+                cell = self.cells.get((row, column))
+                if cell is not None:
+                    slices.append(self.order[cell[0]:cell[1]])
+        return np.concatenate(slices) if slices else self.order[:0]
+
+    def within(self, lat, lon, radius):
+        """ Returns (indices, distances) of points within radius km, nearest first """
+        candidates = self.candidates(lat, lon, radius)
+        distances = haversine(lat, lon, self.lat[candidates],
+                              self.lon[candidates])
+        inside = distances <= radius
+        candidates, distances = candidates[inside], distances[inside]
+        order = np.argsort(distances, kind='stable')
+        return candidates[order], distances[order]
+
+    def nearest(self, lat, lon, n = 1):
+        """ Returns (indices, distances) of n nearest points """
+        n = min(n, len(self.lat))
+        radius = self.cell_km
+        while True:
+            indices, distances = self.within(lat, lon, radius)
+            if len(indices) >= n or radius > math.pi * earth_radius:
+                return indices[:n], distances[:n]
+            radius *= 2
+
+def mkenv():
+    parser = argparse.ArgumentParser(add_help=True,
+                                     description="Find rune stones near a " +
+                                                 "point in KML and Viking dumps.")
+    parser.add_argument("files", type=str, nargs="+",
+                        help="FMIS .kml exports and Viking .vik files.")
+    parser.add_argument("--near", type=str, required=True,
+                        help="Point as LATITUDE,LONGITUDE.")
+    parser.add_argument("-r", "--radius", type=float, default=None,
+                        help="Show all stones within this distance in km.")
+    parser.add_argument("-n", "--nearest", type=int, default=10,
+                        help="Show this number of nearest stones.")
+    return parser.parse_args()
+
+def main():
+    env = mkenv()
+    lat, lon = (float(x) for x in env.near.split(','))
+    stones = Stones.load(env.files)
+    index = GridIndex(stones.coordinates)
+
+    start = time.perf_counter()
+    if env.radius is not None:
+        indices, distances = index.within(lat, lon, env.radius)
+    else:
+        indices, distances = index.nearest(lat, lon, env.nearest)
+    elapsed = time.perf_counter() - start
+
+    for i, distance in zip(indices, distances):
+        print("%8.3f km  %-20s %-18s %s" % (distance, stones.names[i],
+                                            stones.status_name(i) or '',
+                                            stones.sources[i]))
+    print("%d of %d stones, query %.3f ms" % (len(indices), len(stones),
+                                             elapsed * 1000))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
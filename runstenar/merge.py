@@ -0,0 +1,179 @@
+#!/usr/bin/python3
+
+import argparse
+import json
+import re
+import sys
+import urllib.parse
+from collections import Counter
+
+from geodata import GridIndex, Stones, haversine, statuses
+
+# Source of a record by host of its URL. Coordinates of earlier sources
+# are preferred.
+sources = [('fmis', 'fmis.raa.se'),
+           ('stockholmslansmuseum', 'stockholmslansmuseum.se'),
+           ('runinskrifter', 'runinskrifter.net')]
+
+# Status chosen when sources disagree and votes are tied
+status_priority = ['In museum', 'In church', 'Lost or destroyed', 'Alive']
+
+# Signum is land followed by number or reference like "U Fv1959;188".
+# FMIS names like "Södertälje 12:1" are not signa.
+signum_re = re.compile(r'\s*(U|Sö)(?=[\s\d])\s*(\S.*?)\s*$', re.IGNORECASE)
+
+def signum_key(name):
+    """ Normalised signum: "U 650", "u650" and " U  650" give "U650" """
+    m = signum_re.match(name)
+    if m is None:
+        return None
+    return (m.group(1) + re.sub(r'\s+', '', m.group(2))).upper()
+
+def source_name(url):
+    host = urllib.parse.urlsplit(url).netloc
+    for name, domain in sources:
+        if host == domain or host.endswith('.' + domain):
+            return name
+    return host or 'unknown'
+
+class Clusters():
+    """
+    Union-find over records. Every cluster keeps its signum keys and
+    sources; two clusters may be merged only if they have at most one signum
+    between them and no source in common, i.e. a source never describes one
+    stone twice unless under the same signum.
+    """
+    def __init__(self, keys, record_sources):
+        self.parent = list(range(len(keys)))
+        self.keys = [{k} if k else set() for k in keys]
+        self.sources = [{s} for s in record_sources]
+
+    def find(self, i):
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i, j, same_name = False):
+        a, b = self.find(i), self.find(j)
+        if a == b:
+            return True
+        if len(self.keys[a] | self.keys[b]) > 1:
+            return False
+        if not same_name and self.sources[a] & self.sources[b]:
+            return False
+        if len(self.sources[a]) < len(self.sources[b]):
+            a, b = b, a
+        self.parent[b] = a
+        self.keys[a] |= self.keys[b]
+        self.sources[a] |= self.sources[b]
+        return True
+
+    def groups(self):
+        ret = {}
+        for i in range(len(self.parent)):
+            ret.setdefault(self.find(i), []).append(i)
+        return sorted(ret.values())
+
+def reconcile(stones, members, record_sources, keys):
+    """ Canonical record with provenance for records of one stone """
+    rank = {name: i for i, (name, _) in enumerate(sources)}
+    best = min(members, key=lambda i: (rank.get(record_sources[i], len(rank)), i))
+    named = [i for i in members if keys[i]]
+    name = stones.names[min(named, key=lambda i: (
+        record_sources[i] != 'runinskrifter', i))] if named else stones.names[best]
+
+    votes = Counter(stones.status_name(i) for i in members
+                    if stones.status[i] >= 0)
+    status = None
+    if votes:
+        top = max(votes.values())
+        status = min((s for s in votes if votes[s] == top),
+                     key=status_priority.index)
+
+    return {
+        'name': name.strip(),
+        'aliases': sorted({stones.names[i].strip() for i in members} -
+                          {name.strip()}),
+        'latitude': float(stones.coordinates[best, 0]),
+        'longitude': float(stones.coordinates[best, 1]),
+        'status': status,
+        'conflict': len(votes) > 1,
+        'records': [{'source': record_sources[i],
+                     'name': stones.names[i],
+                     'url': stones.sources[i],
+                     'latitude': float(stones.coordinates[i, 0]),
+                     'longitude': float(stones.coordinates[i, 1]),
+                     'status': stones.status_name(i)} for i in members],
+    }
+
+def merge(stones, radius = 0.05, name_radius = 5.):
+    """
+    Returns canonical records. Records with the same signum within
+    name_radius km are the same stone. Other records are matched to their
+    nearest compatible neighbours within radius km, closest pairs first.
+    """
+    record_sources = [source_name(url) for url in stones.sources]
+    keys = [signum_key(name) for name in stones.names]
+    clusters = Clusters(keys, record_sources)
+    lat, lon = stones.coordinates[:, 0], stones.coordinates[:, 1]
+
+    by_key = {}
+    for i, key in enumerate(keys):
+        if key:
+            by_key.setdefault(key, []).append(i)
+    for members in by_key.values():
+        first = members[0]
+        near = haversine(lat[first], lon[first], lat[members], lon[members])
+        for i, distance in zip(members[1:], near[1:]):
+            if distance <= name_radius:
+                clusters.union(first, i, same_name=True)
+
+    index = GridIndex(stones.coordinates, max(radius, 0.1))
+    pairs = []
+    for i in range(len(stones)):
+        indices, distances = index.within(lat[i], lon[i], radius)
+        for j, distance in zip(indices.tolist(), distances.tolist()):
+            if j > i and record_sources[i] != record_sources[j]:
+                pairs.append((distance, i, j))
+    pairs.sort()
+    for distance, i, j in pairs:
+        clusters.union(i, j)
+
+    return [reconcile(stones, members, record_sources, keys)
+            for members in clusters.groups()]
+
+def mkenv():
+    parser = argparse.ArgumentParser(add_help=True,
+                                     description="Merge rune stones from " +
+                                                 "all sources into one " +
+                                                 "dataset.")
+    parser.add_argument("files", type=str, nargs="+",
+                        help="FMIS .kml, Viking .vik and scraper .txt files.")
+    parser.add_argument("-o", "--output", type=str, default="merged.json")
+    parser.add_argument("-r", "--radius", type=float, default=50.,
+                        help="Records of different sources within this " +
+                             "distance in meters may be the same stone.")
+    parser.add_argument("--name-radius", type=float, default=5.,
+                        help="Records with the same signum within this " +
+                             "distance in km are the same stone.")
+    return parser.parse_args()
+
+def main():
+    env = mkenv()
+    stones = Stones.load(env.files)
+    merged = merge(stones, env.radius / 1000., env.name_radius)
+    with open(env.output, 'w', encoding='utf-8') as f:
+        json.dump(merged, f, ensure_ascii=False, indent=1)
+
+    per_status = Counter(r['status'] for r in merged)
+    print("%d records merged into %d stones" % (len(stones), len(merged)))
+    for status in statuses + [None]:
+        print("  %-18s %d" % (status or 'Unknown', per_status[status]))
+    print("%d stones with multiple sources, %d with conflicting status"
+          % (sum(len({r['source'] for r in m['records']}) > 1 for m in merged),
+             sum(m['conflict'] for m in merged)))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
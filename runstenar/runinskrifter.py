@@ -1,9 +1,15 @@
 #!/usr/bin/python3
 
+import argparse
 import sys
-import urllib.request
+import urllib.parse
 from html.parser import HTMLParser
 
+import export
+import fetch_cache
+import snapshot
+from geodata import Stones
+
 root_url = 'https://www.runinskrifter.net/signum'
 lands = ['U', 'Sö']
 
@@ -77,39 +83,78 @@ class RunstenParser(HTMLParser):
             elif self.stage == self.LONGITUDE:
                 self.longitude = dms2d(data)
 
-def main():
-    template = "type=\"waypoint\" latitude=\"%.15f\" longitude=\"%.15f\" name=\"%s\" comment=\"Source: %s\"\n"
-    flive = open('live.txt', 'w')
-    fdead = open('dead.txt', 'w')
-    for land in lands:
-        land_url = root_url + '/' + land
-        land_url = urllib.parse.quote_plus(land_url, ':/')
-        data = urllib.request.urlopen(land_url).read()
-
-        parser = RootHTMLParser()
-        parser.feed(data.decode('utf-8'))
-        for runsten in parser.runstenar:
-            runsten_url = root_url + '/' + land + '/' + runsten.name.split()[1]
-            runsten_url = urllib.parse.quote(runsten_url, ':/')
-            data = urllib.request.urlopen(runsten_url).read()
-
-            runsten_data = RunstenParser()
-            runsten_data.feed(data.decode('utf-8'))
-            runsten.latitude = runsten_data.latitude
-            runsten.longitude = runsten_data.longitude
-
-            if runsten.latitude == 0 and runsten.longitude == 0:
-                print("Undefined coordinates for runsten %s" % runsten.name)
-                continue
-
-            output_str = template % (runsten.latitude, runsten.longitude, runsten.name, runsten_url)
-            if runsten.alive:
-                flive.write(output_str)
-            else:
-                fdead.write(output_str)
+def coordinates(crawler, runsten_url):
+    """ Returns (latitude, longitude, page hash) """
+    data = crawler.fetch(runsten_url)
+    runsten_data = RunstenParser()
+    runsten_data.feed(data.decode('utf-8'))
+    return runsten_data.latitude, runsten_data.longitude, snapshot.page_hash(data)
+
+def status(runsten):
+    return 'Alive' if runsten.alive else 'Lost or destroyed'
+
+def mkenv():
+    parser = argparse.ArgumentParser(add_help=True,
+                                     description="Collect rune stones from " +
+                                                 "runinskrifter.net.")
+    parser.add_argument("--url", type=str, default=root_url,
+                        help="Root URL of signum pages.")
+    fetch_cache.add_arguments(parser)
+    snapshot.add_arguments(parser, 'runinskrifter.json')
+    export.add_arguments(parser)
+    parser.add_argument("--full", action="store_true",
+                        help="Fetch every stone page, not only pages of " +
+                             "stones whose entry in the land index changed.")
+    return parser.parse_args()
 
-    flive.close()
-    fdead.close()
+def main():
+    env = mkenv()
+    last = snapshot.Snapshot(env.snapshot)
+    with fetch_cache.crawler(env, 'runinskrifter') as crawler:
+        land_urls = [urllib.parse.quote_plus(env.url + '/' + land, ':/')
+                     for land in lands]
+        runstenar = []
+        for land, data in zip(lands, crawler.fetch_all(land_urls)):
+            parser = RootHTMLParser()
+            parser.feed(data.decode('utf-8'))
+            for runsten in parser.runstenar:
+                runsten_url = env.url + '/' + land + '/' + runsten.name.split()[1]
+                runstenar.append((runsten, urllib.parse.quote(runsten_url, ':/')))
+
+        def runsten_data(r):
+            runsten, runsten_url = r
+            old = last.get(runsten_url)
+            if (not env.full and old is not None and
+                    old['name'] == runsten.name and
+                    old['status'] == status(runsten)):
+                # Listing entry didn't change since the last crawl
+                return old['latitude'], old['longitude'], old['sha1']
+            return coordinates(crawler, runsten_url)
+
+        # Pages are fetched in parallel, results come in the original order
+        results = crawler.map(runsten_data, runstenar)
+        crawler.finish()
+
+    stones = {}
+    records = []
+    for (runsten, runsten_url), (latitude, longitude, sha1) in zip(runstenar, results):
+        runsten.latitude = latitude
+        runsten.longitude = longitude
+        stones[runsten_url] = snapshot.stone(runsten.name, status(runsten),
+                                             latitude, longitude, sha1)
+
+        if runsten.latitude == 0 and runsten.longitude == 0:
+            print("Undefined coordinates for runsten %s" % runsten.name)
+            continue
+        records.append((runsten.name, latitude, longitude, runsten_url,
+                        status(runsten)))
+
+    found = Stones.from_records(records)
+    export.write_status_files(found, {'Alive': 'live.txt',
+                                      'Lost or destroyed': 'dead.txt'})
+    for filename in env.output:
+        export.export(found, filename)
+    snapshot.finish(env, last, stones)
     return 0
 
 if __name__ == "__main__":
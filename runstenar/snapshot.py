@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+
+import export
+from geodata import haversine
+
+def page_hash(data):
+    return hashlib.sha1(data).hexdigest()
+
+class Snapshot():
+    """
+    Result of the last crawl: stones[url] = {'name', 'status', 'latitude',
+    'longitude', 'sha1'} where sha1 is hash of the stone page.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.stones = {}
+        if filename and os.path.exists(filename):
+            with open(filename, 'r', encoding='utf-8') as f:
+                self.stones = json.load(f)
+
+    def get(self, url):
+        return self.stones.get(url)
+
+    def save(self, stones):
+        """ Replace snapshot with stones, the same dict as self.stones """
+        export.write(self.filename, json.dumps(stones, ensure_ascii=False,
+                                               indent=1, sort_keys=True))
+        self.stones = stones
+
+def stone(name, status, latitude, longitude, sha1):
+    return {'name': name, 'status': status, 'latitude': latitude,
+            'longitude': longitude, 'sha1': sha1}
+
+def diff(old, new, moved_km = 0.01):
+    """
+    Changes between two snapshots' stones as dict of lists of
+    (url, old stone, new stone): added, removed, status, moved and page
+    (page content changed but none of the above).
+    """
+    report = {'added': [], 'removed': [], 'status': [], 'moved': [],
+              'page': []}
+    for url in sorted(old.keys() - new.keys()):
+        report['removed'].append((url, old[url], None))
+    for url in sorted(new.keys() - old.keys()):
+        report['added'].append((url, None, new[url]))
+
+    common = sorted(old.keys() & new.keys())
+    distances = haversine(
+        np.array([old[u]['latitude'] for u in common], dtype=np.float64),
+        np.array([old[u]['longitude'] for u in common], dtype=np.float64),
+        np.array([new[u]['latitude'] for u in common], dtype=np.float64),
+        np.array([new[u]['longitude'] for u in common], dtype=np.float64))
+    for url, distance in zip(common, distances):
+        a, b = old[url], new[url]
+        if a['status'] != b['status'] or a['name'] != b['name']:
+            report['status'].append((url, a, b))
+        elif distance > moved_km:
+            report['moved'].append((url, a, b))
+        elif a['sha1'] != b['sha1']:
+            report['page'].append((url, a, b))
+    return report
+
+def print_report(report, f = sys.stdout):
+    def position(s):
+        return "(%.6f, %.6f)" % (s['latitude'], s['longitude'])
+
+    titles = [('added', "New stones"), ('removed', "Removed stones"),
+              ('status', "Changed status or name"), ('moved', "Moved stones"),
+              ('page', "Changed pages")]
+    for key, title in titles:
+        changes = report[key]
+        if not changes:
+            continue
+        f.write("%s (%d):\n" % (title, len(changes)))
+        for url, a, b in changes:
+            if key == 'added':
+                line = "%s %s %s" % (b['name'], b['status'], position(b))
+            elif key == 'removed':
+                line = "%s %s %s" % (a['name'], a['status'], position(a))
+            elif key == 'status':
+                line = "%s %s -> %s %s" % (a['name'], a['status'], b['name'],
+                                           b['status'])
+            elif key == 'moved':
+                line = "%s %s -> %s" % (b['name'], position(a), position(b))
+            else:
+                line = b['name']
+            f.write("  %s  %s\n" % (line, url))
+    if not any(report.values()):
+        f.write("No changes since the last crawl\n")
+
+def add_arguments(parser, default):
+    parser.add_argument("--snapshot", type=str, default=default,
+                        help="Result of the last crawl. Changes against " +
+                             "it are reported.")
+    parser.add_argument("--report", type=str, default=None,
+                        help="Write report of changes to this file too.")
+
+def finish(env, snapshot, stones):
+    """ Report changes against the snapshot and store the new one """
+    if snapshot.stones:
+        report = diff(snapshot.stones, stones)
+        print_report(report)
+        if env.report:
+            with open(env.report, 'w', encoding='utf-8') as f:
+                print_report(report, f)
+    snapshot.save(stones)
@@ -1,10 +1,17 @@
 #!/usr/bin/python3
 
+import argparse
 import re
 import sys
-import urllib.request
+import threading
+import urllib.error
 from html.parser import HTMLParser
 
+import export
+import fetch_cache
+import snapshot
+from geodata import Stones
+
 root_url = "http://old.stockholmslansmuseum.se/faktabanken/visa-runa/"
 
 class RunstenParser(HTMLParser):
@@ -81,48 +88,124 @@ class RunstenParser(HTMLParser):
 
             self.comment = data
 
-def main():
-    i = 1
-    template = "type=\"waypoint\" latitude=\"%.15f\" longitude=\"%.15f\" name=\"%s\" comment=\"Source: %s\"\n"
-    flive = open('live.txt', 'w')
-    fdead = open('dead.txt', 'w')
-    fmuseum = open('museum.txt', 'w')
-    fchurch = open('church.txt', 'w')
-    while True:
-        runsten_url = root_url + str(i)
+class IdRangeScanner():
+    """
+    Finds all pages url + id. Missing pages answer with HTTP 500, which is
+    also what the server sometimes returns for existing pages. So the range
+    ends only where `confirm` consecutive pages are missing. The end is
+    found with exponential and then binary search, pages are fetched by
+    the crawler in parallel.
+    """
+    def __init__(self, crawler, url, confirm = 5):
+        self.crawler = crawler
+        self.url = url
+        self.confirm = confirm
+        self.lock = threading.Lock()
+        self.pages = {} # pages[id] = page data or None if missing
+
+    def page(self, i):
+        with self.lock:
+            if i in self.pages:
+                return self.pages[i]
         try:
-            data = urllib.request.urlopen(runsten_url).read()
+            data = self.crawler.fetch(self.url + str(i))
         except urllib.error.HTTPError as e:
-            if e.code == 500:
-                # All rune stones have been handled
-                break
-            else:
+            if e.code != 500:
                 raise
+            data = None
+        with self.lock:
+            self.pages[i] = data
+        return data
+
+    def is_end(self, i):
+        pages = self.crawler.map(self.page, range(i, i + self.confirm))
+        return all(data is None for data in pages)
+
+    def end(self):
+        """ First id of the run of missing pages after the last page """
+        lo, hi = 0, 1 # is_end(lo) is False, is_end(hi) may be True
+        while not self.is_end(hi):
+            lo, hi = hi, hi * 2
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if self.is_end(mid):
+                hi = mid
+            else:
+                lo = mid
+        return hi
+
+    def scan(self):
+        """ Returns [(id, data)] in id order, data is None for missing pages """
+        ids = range(1, self.end())
+        pages = self.crawler.map(self.page, ids)
+
+        # One more attempt for pages missing inside the range
+        missing = [i for i, data in zip(ids, pages) if data is None]
+        with self.lock:
+            for i in missing:
+                del self.pages[i]
+        self.crawler.map(self.page, missing)
+        return [(i, self.pages[i]) for i in ids]
+
+def mkenv():
+    parser = argparse.ArgumentParser(add_help=True,
+                                     description="Collect rune stones from " +
+                                                 "Stockholms läns museum.")
+    parser.add_argument("--url", type=str, default=root_url,
+                        help="URL of rune stone pages without number.")
+    parser.add_argument("--confirm", type=int, default=5,
+                        help="Number of consecutive missing pages that " +
+                             "mark the end of rune stones.")
+    fetch_cache.add_arguments(parser)
+    snapshot.add_arguments(parser, 'stockholmslansmuseum.json')
+    export.add_arguments(parser)
+    return parser.parse_args()
+
+def main():
+    env = mkenv()
+    last = snapshot.Snapshot(env.snapshot)
+    stones = {}
+    with fetch_cache.crawler(env, 'stockholmslansmuseum') as crawler:
+        pages = IdRangeScanner(crawler, env.url, env.confirm).scan()
+        crawler.finish()
+
+    records = []
+    for i, data in pages:
+        runsten_url = env.url + str(i)
+        if data is None:
+            print("Missing runsten %s" % runsten_url)
+            continue
 
         runsten = RunstenParser()
         runsten.feed(data.decode('utf-8'))
 
         if runsten.latitude == 0 and runsten.longitude == 0:
             print("Unrecognized runsten %s" % runsten_url)
-            i += 1
             continue
 
-        output_str = template % (runsten.latitude, runsten.longitude, runsten.name, runsten_url)
         if runsten.in_church:
-            fchurch.write(output_str)
+            status = 'In church'
         elif runsten.in_museum:
-            fmuseum.write(output_str)
+            status = 'In museum'
         elif runsten.alive:
-            flive.write(output_str)
+            status = 'Alive'
         else:
-            fdead.write(output_str)
-
-        i += 1
-
-    flive.close()
-    fdead.close()
-    fmuseum.close()
-    fchurch.close()
+            status = 'Lost or destroyed'
+        records.append((runsten.name, runsten.latitude, runsten.longitude,
+                        runsten_url, status))
+        stones[runsten_url] = snapshot.stone(runsten.name, status,
+                                             runsten.latitude,
+                                             runsten.longitude,
+                                             snapshot.page_hash(data))
+
+    found = Stones.from_records(records)
+    export.write_status_files(found, {'Alive': 'live.txt',
+                                      'Lost or destroyed': 'dead.txt',
+                                      'In museum': 'museum.txt',
+                                      'In church': 'church.txt'})
+    for filename in env.output:
+        export.export(found, filename)
+    snapshot.finish(env, last, stones)
     return 0
 
 if __name__ == "__main__":